@@ -0,0 +1,397 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--sizes", type=str, default="1K,64K,1M,10M",
+        metavar="", help="file sizes, comma separated (K, M, G suffixes)",
+    )
+    parser.add_argument(
+        "--protocols", type=str, default="sw,sr",
+        metavar="", help="protocols, comma separated",
+    )
+    parser.add_argument(
+        "--operations", type=str, default="upload,download",
+        metavar="", help="operations, comma separated",
+    )
+    parser.add_argument(
+        "--clients", type=str, default="1,4",
+        metavar="", help="concurrent client counts, comma separated",
+    )
+    parser.add_argument(
+        "--loss", type=str, default="0",
+        metavar="", help="loss rates (0 to 1), comma separated",
+    )
+    parser.add_argument(
+        "--congestion", type=str, default="reno",
+        metavar="", help="sr congestion controls, comma separated",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        metavar="", help="runs of every combination",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600,
+        metavar="", help="seconds before a run is aborted",
+    )
+    parser.add_argument(
+        "--server-args", type=str, default="",
+        metavar="", help="extra start-server arguments, quoted",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None,
+        metavar="", help="append JSON lines to this file (default stdout)",
+    )
+
+
+def parse_size(text) -> int:
+    text = text.strip().upper()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_list(text, convert=str) -> list:
+    return [convert(item) for item in text.split(",") if item.strip()]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True, cwd=os.path.dirname(__file__) or ".",
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_random_file(path, size):
+    with open(path, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, 1024 ** 2)
+            file.write(os.urandom(chunk))
+            remaining -= chunk
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 ** 2), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _sigint_default():
+    # Si el benchmark corre en background SIGINT llega ignorado y los
+    # hijos lo heredan: el server no podría cerrar ordenadamente
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def wait_rusage(process, timeout):
+    """Wait for process (killed after timeout) reaping it with wait4,
+    returns (returncode, cpu seconds, peak RSS in KB)"""
+    deadline = time.monotonic() + timeout
+    flags = os.WNOHANG
+    while True:
+        pid, status, usage = os.wait4(process.pid, flags)
+        if pid == process.pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return (process.returncode, usage.ru_utime + usage.ru_stime,
+                    usage.ru_maxrss)
+        if time.monotonic() < deadline:
+            time.sleep(0.01)
+        else:
+            process.kill()
+            flags = 0
+
+
+def wait_all_rusage(processes, timeout) -> dict:
+    """wait_rusage for several processes at once. Each one is stamped when
+    it actually exits, whatever the order: returns {pid: (returncode, cpu
+    seconds, peak RSS in KB, monotonic end time)}. The ones still running
+    after timeout are killed"""
+    deadline = time.monotonic() + timeout
+    pending = {process.pid: process for process in processes}
+    results = {}
+    flags = os.WNOHANG
+    while pending:
+        for pid, process in list(pending.items()):
+            reaped, status, usage = os.wait4(pid, flags)
+            if reaped != pid:
+                continue
+            process.returncode = os.waitstatus_to_exitcode(status)
+            results[pid] = (process.returncode,
+                            usage.ru_utime + usage.ru_stime,
+                            usage.ru_maxrss, time.monotonic())
+            del pending[pid]
+        if not pending:
+            break
+        if time.monotonic() < deadline:
+            time.sleep(0.005)
+        elif flags:
+            for process in pending.values():
+                process.kill()
+            flags = 0
+    return results
+
+
+class LossyProxy:
+    """UDP relay between the clients and the server, drops every datagram
+    with probability loss in both directions, the handshake included"""
+
+    def __init__(self, server_address, loss):
+        self.server_address = server_address
+        self.loss = loss
+        self.random = random.Random()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.address = self.socket.getsockname()
+        self.upstreams = {}  # cliente -> socket hacia el server
+        self.dropped = 0
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def drop(self) -> bool:
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return True
+        return False
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.2):
+                data, address = key.fileobj.recvfrom(65535)
+                client = key.data
+                if client is None:  # Cliente -> server
+                    upstream = self.upstreams.get(address)
+                    if upstream is None:
+                        upstream = self.connect(address)
+                    if self.drop():
+                        continue
+                    upstream.sendto(data, self.server_address)
+                elif not self.drop():  # Server -> cliente
+                    self.socket.sendto(data, client)
+
+    def connect(self, client):
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        upstream.bind(("127.0.0.1", 0))
+        self.upstreams[client] = upstream
+        self.selector.register(upstream, selectors.EVENT_READ, client)
+        return upstream
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+        for upstream in self.upstreams.values():
+            upstream.close()
+        self.socket.close()
+
+
+class Server:
+    """start-server.py as a subprocess with its own storage dir"""
+
+    def __init__(self, storage, protocol, extra_args, workdir):
+        self.port = free_udp_port()
+        self.metrics_path = os.path.join(workdir, "metrics.json")
+        self.log_path = os.path.join(workdir, "server.log")
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "start-server.py", "-q", "-H", "127.0.0.1",
+             "-p", str(self.port), "-s", storage, "-r", protocol,
+             "--metrics-file", self.metrics_path, *extra_args],
+            stdout=self.log, stderr=subprocess.STDOUT,
+            preexec_fn=_sigint_default, cwd=os.path.dirname(__file__) or ".",
+            env=dict(os.environ, PYTHONUNBUFFERED="1"),
+        )
+        self.wait_started()
+
+    def wait_started(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with open(self.log_path) as log:
+                if "Server started" in log.read():
+                    return
+            if self.process.poll() is not None:
+                break
+            time.sleep(0.05)
+        raise RuntimeError(f"Server did not start, see {self.log_path}")
+
+    def stop(self, timeout=10) -> dict:
+        """SIGINT and wait, returns cpu, peak RSS and the last metrics"""
+        self.process.send_signal(signal.SIGINT)
+        _, cpu, peak_rss = wait_rusage(self.process, timeout)
+        self.log.close()
+        try:
+            with open(self.metrics_path) as metrics_file:
+                totals = json.load(metrics_file)["totals"]
+        except (OSError, ValueError, KeyError):
+            totals = {}
+        return {"cpu": cpu, "peak_rss": peak_rss, "totals": totals}
+
+
+def run_case(operation, protocol, size, clients, loss, congestion, args,
+             workdir):
+    storage = os.path.join(workdir, "server")
+    local = os.path.join(workdir, "client")
+    for directory in (storage, local):
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if not name.startswith("src_"):
+                os.remove(os.path.join(directory, name))
+
+    source_dir = local if operation == "upload" else storage
+    source = os.path.join(source_dir, f"src_{size}.bin")
+    if not os.path.exists(source):
+        write_random_file(source, size)
+    source_digest = file_digest(source)
+
+    server = Server(storage, protocol,
+                    ["--congestion", congestion, *args.server_args.split()],
+                    workdir)
+    target = ("127.0.0.1", server.port)
+    proxy = LossyProxy(target, loss) if loss > 0 else None
+    if proxy is not None:
+        target = proxy.address
+
+    processes = []
+    started = time.monotonic()
+    for i in range(clients):
+        common = ["-q", "-H", target[0], "-p", str(target[1]),
+                  "-r", protocol]
+        if operation == "upload":
+            result_path = os.path.join(storage, f"up_{i}.bin")
+            command = ["upload.py", *common, "-s", source,
+                       "-n", f"up_{i}.bin", "--congestion", congestion]
+        else:
+            result_path = os.path.join(local, f"down_{i}.bin")
+            command = ["download.py", *common, "-n", f"src_{size}.bin",
+                       "-d", result_path]
+        process = subprocess.Popen(
+            [sys.executable, *command], stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, cwd=os.path.dirname(__file__) or ".")
+        processes.append((process, result_path, time.monotonic()))
+
+    latencies, client_cpu, client_rss, failures = [], 0.0, 0, 0
+    remaining = max(0.0, args.timeout - (time.monotonic() - started))
+    reaped = wait_all_rusage([process for process, _, _ in processes],
+                             remaining)
+    for process, result_path, client_start in processes:
+        returncode, cpu, peak_rss, ended = reaped[process.pid]
+        latencies.append(ended - client_start)
+        client_cpu += cpu
+        client_rss = max(client_rss, peak_rss)
+        if returncode != 0 or not _same_file(result_path, source_digest):
+            failures += 1
+    wall = time.monotonic() - started
+
+    if proxy is not None:
+        proxy.close()
+    server_usage = server.stop()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "operation": operation,
+        "protocol": protocol,
+        "size": size,
+        "clients": clients,
+        "loss": loss,
+        "congestion": congestion,
+        "ok": failures == 0,
+        "failures": failures,
+        "wall": round(wall, 4),
+        "goodput": round(size * (clients - failures) / wall),
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p90": round(percentile(latencies, 90), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+        "latency_max": round(max(latencies), 4),
+        "client_cpu": round(client_cpu, 4),
+        "client_peak_rss_kb": client_rss,
+        "server_cpu": round(server_usage["cpu"], 4),
+        "server_peak_rss_kb": server_usage["peak_rss"],
+        "retransmits": server_usage["totals"].get("retransmits"),
+        "duplicates": server_usage["totals"].get("duplicates"),
+        "dropped": proxy.dropped if proxy is not None else 0,
+    }
+
+
+def _same_file(path, digest):
+    # El server puede estar escribiendo el final de un upload todavía
+    for _ in range(20):
+        if file_digest(path) == digest:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        usage="benchmark [-h] [--sizes LIST] [--protocols LIST]"
+        " [--operations LIST] [--clients LIST] [--loss LIST]"
+        " [--congestion LIST] [--repeat N]"
+        " [--timeout SECONDS] [--server-args ARGS] [-o FILE]",
+        description="Run upload/download transfers against a local server"
+        " over a matrix of cases, prints one JSON line per run",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    matrix = list(itertools.product(
+        parse_list(args.operations), parse_list(args.protocols),
+        parse_list(args.sizes, parse_size), parse_list(args.clients, int),
+        parse_list(args.loss, float), parse_list(args.congestion),
+        range(args.repeat)))
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as workdir:
+        for n, case in enumerate(matrix, 1):
+            operation, protocol, size, clients, loss, congestion, _ = case
+            print(f"[{n}/{len(matrix)}] {operation} {protocol} {size} bytes,"
+                  f" {clients} clients, loss {loss}, {congestion}",
+                  file=sys.stderr)
+            result = run_case(operation, protocol, size, clients, loss,
+                              congestion, args, workdir)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    if output is not sys.stdout:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
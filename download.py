@@ -1,6 +1,9 @@
 import argparse
 from lib.client.client_manager import run
 from lib.client.downloader import Downloader
+from lib.utils.constants import ACK_DELAY, ACK_EVERY, BUFFER_SIZE, RATE
+from lib.utils.static import (
+    CHECKSUMS, COMPRESSIONS, parse_ack_delay, parse_rate, parse_segment_size)
 
 
 def add_arguments(parser):
@@ -30,17 +33,56 @@ def add_arguments(parser):
         metavar="", help="destination file path"
     )
     parser.add_argument(
-        "-r", "--protocol", type=str, choices=["sw", "sr"],
+        "-r", "--protocol", type=str, choices=["sw", "sr", "fec"],
         default="sw", required=False,
         metavar="", help="error recovery protocol",
     )
+    parser.add_argument(
+        "--ack-every", type=int, default=ACK_EVERY,
+        metavar="", help="segments confirmed by each ACK (sr)",
+    )
+    parser.add_argument(
+        "--ack-delay", type=parse_ack_delay, default=ACK_DELAY,
+        metavar="", help="seconds an ACK waits for more segments (sr)",
+    )
+    parser.add_argument(
+        "--rate", type=parse_rate, default=RATE, metavar="",
+        help="pacing in bytes/s (K, M, G suffixes) or auto",
+    )
+    parser.add_argument(
+        "--segment-size", type=parse_segment_size, default=BUFFER_SIZE,
+        metavar="", help="segment size in bytes, header included",
+    )
+    parser.add_argument(
+        "--pmtu", action="store_true",
+        help="probe the largest segment size the path carries whole",
+    )
+    parser.add_argument(
+        "--initial-window", type=int, default=None,
+        metavar="", help="initial congestion window in segments (sr)",
+    )
+    parser.add_argument(
+        "--compress", type=str, choices=list(COMPRESSIONS),
+        default="none", metavar="", help="segment compression (none, zlib)",
+    )
+    parser.add_argument(
+        "--checksum", type=str, choices=list(CHECKSUMS),
+        default="crc32", metavar="", help="segment checksum (crc32, none)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue a partial transfer of the same file",
+    )
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog="download",
         usage="download [-h] [-v | -q] [-H ADDR] [-p PORT] [-d FILEPATH]"
-        " [-n FILENAME] [-r protocol]",
+        " [-n FILENAME] [-r protocol] [--ack-every N]"
+        " [--ack-delay SECONDS] [--rate RATE] [--segment-size N]"
+        " [--pmtu] [--initial-window N] [--compress algorithm]"
+        " [--checksum algorithm] [--resume]",
         description="Download a file named FILENAME on the server running"
         " in ADDR:PORT and save it on FILEPATH",
         formatter_class=argparse.RawTextHelpFormatter,
@@ -56,6 +98,15 @@ def main():
         print(f"Port         : {args.port}")
         print(f"Destination  : {args.dst}")
         print(f"Protocol     : {args.protocol}")
+        print(f"ACK every    : {args.ack_every}")
+        print(f"ACK delay    : {args.ack_delay}")
+        print(f"Rate         : {args.rate}")
+        print(f"Segment size : {args.segment_size}")
+        print(f"PMTU probing : {args.pmtu}")
+        print(f"Init window  : {args.initial_window}")
+        print(f"Compression  : {args.compress}")
+        print(f"Checksum     : {args.checksum}")
+        print(f"Resume       : {args.resume}")
 
     return run(Downloader(args, is_client=True))
 
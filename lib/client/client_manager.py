@@ -1,6 +1,18 @@
+import errno
+import random
+import socket
+import sys
 import time
-from lib.utils.segments import InitSegment
-from ..utils.constants import BUFFER_SIZE
+from lib.utils.segments import InitSegment, ProbeSegment
+from ..utils.constants import (
+    BUFFER_SIZE, DOWNLOAD_OPERATION, EARLY_DATA, INIT_ATTEMPTS,
+    INIT_TIMEOUT, INIT_VERSION, LEGACY_ERROR, MAX_ATTEMPTS, MAX_RTO,
+    PMTU_ATTEMPTS, PMTU_FLOOR, PMTU_TIMEOUT)
+
+# Linux: los probes salen con DF sin importar la MTU que el kernel ya
+# tenga cacheada para el destino
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_PROBE = 3
 
 
 def run(operation):
@@ -23,6 +35,12 @@ def run(operation):
         operation.transfer(is_client=True)
         operation.terminate()
 
+        if operation.error is not None:
+            print("[CLIENT] Transfer failed")
+            if not operation.quiet:
+                print(f"Error: {operation.error}")
+            return 1
+
         return 0
 
     except Exception as e:
@@ -42,11 +60,12 @@ def init_connection(operation) -> bool:
         if not operation.quiet:
             print("[CLIENT] Initiating connection with server")
 
-        # Create and send INIT message
-        init_segment = InitSegment(operation.op_code, operation.protocol_code,
-                                   0b0, operation.file_name)
+        if operation.pmtu:
+            operation.segment_size = probe_path_mtu(operation)
 
-        init_message = init_segment.serialize(operation.verbose)
+        # Create and send INIT message
+        request = build_init(operation)
+        init_message = request.serialize(operation.verbose)
 
         if operation.verbose:
             print(f"[CLIENT] Created init message with data: {init_message}")
@@ -54,29 +73,209 @@ def init_connection(operation) -> bool:
                   f"{operation.destination_address[0]}:"
                   f"{operation.destination_address[1]}")
 
-        operation.socket.sendto(
-            init_message, operation.destination_address)
+        # El INIT o su INIT_ACK se pueden perder: se reenvía con backoff
+        timeout, sent, busy = INIT_TIMEOUT, 0, 0
+        while True:
+            if sent == INIT_ATTEMPTS:
+                operation.error = "No response from server after " \
+                    f"{INIT_ATTEMPTS} attempts"
+                return False
+            operation.socket.sendto(
+                init_message, operation.destination_address)
+            sent += 1
 
-        if not operation.quiet:
-            print("[CLIENT] Waiting for server response")
+            if not operation.quiet:
+                print("[CLIENT] Waiting for server response")
 
-        # Wait for server response
-        operation.socket.settimeout(5)  # 5 seconds timeout for INIT response
-        response, _ = operation.socket.recvfrom(BUFFER_SIZE)
+            reply, response = wait_init_reply(operation, timeout)
+            if reply is None:
+                if not operation.quiet:
+                    print(f"[CLIENT] No response in {timeout:.2f}s, "
+                          f"resending INIT ({sent}/{INIT_ATTEMPTS})")
+                timeout = min(timeout * 2, MAX_RTO)
+                continue
 
-        if not operation.quiet:
-            print("[CLIENT] Received server response")
+            if not operation.quiet:
+                print("[CLIENT] Received server response")
 
-        if operation.verbose:
-            print(f"[CLIENT] Received bytes: {response}")
+            if not isinstance(reply, InitSegment):
+                # Un servidor anterior no entiende el INIT extendido y
+                # responde con su error genérico: se reintenta con el
+                # original. Cualquier otro error es la respuesta
+                if not request.version or reply != LEGACY_ERROR:
+                    raise ValueError(reply.decode(errors="replace"))
+                print("[CLIENT] Server does not support the extended "
+                      "INIT, falling back")
+                request = build_init(operation, version=0)
+                init_message = request.serialize(operation.verbose)
+                sent = 0
+                continue
+
+            init_segment = reply
+            if not init_segment.busy:
+                # Sus copias (si se reenvió el INIT) llegan como datos
+                operation.init_ack = bytes(response)
+                break
+
+            busy += 1
+            if busy == MAX_ATTEMPTS:
+                operation.error = "Server busy, no more attempts left"
+                return False
+
+            # Servidor ocupado: esperar lo que pide (con jitter, para no
+            # reintentar todos juntos) y volver a mandar el INIT
+            retry_after = init_segment.retry_after()
+            print(f"[CLIENT] Server busy, retrying in {retry_after:.1f}s "
+                  f"({busy}/{MAX_ATTEMPTS})")
+            time.sleep(retry_after * random.uniform(1, 1.5))
+            timeout, sent = INIT_TIMEOUT, 0
 
-        init_segment = InitSegment.deserialize(response, operation.verbose)
         if not init_segment.ack == 0b1:
             operation.error = "Response from server is not ACK"
             return False
 
+        # Lo que el servidor no manda (uno viejo) queda por defecto
+        operation.apply_init(init_segment)
+        if not operation.quiet:
+            print(f"[CLIENT] Segment size: {init_segment.segment_size}, "
+                  f"initial window: {init_segment.initial_window}, "
+                  f"file size: {init_segment.file_size}, "
+                  f"resume offset: {init_segment.resume_offset}")
+
         return True
 
     except Exception as e:
         operation.error = f"Connection initialization failed: {str(e)}"
         return False
+
+
+def wait_init_reply(operation, timeout):
+    """The server answer to the INIT as (reply, datagram): reply is an
+    InitSegment, or the error bytes of a server that could not take it.
+    (None, None) if nothing comes within timeout seconds. Data of a
+    download that got ahead of its INIT_ACK is kept in
+    operation.early_data, the rest is dropped"""
+    deadline = time.monotonic() + timeout
+    size = max(BUFFER_SIZE, operation.segment_size)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return (None, None)
+        operation.socket.settimeout(remaining)
+        try:
+            response, _ = operation.socket.recvfrom(size)
+        except socket.timeout:
+            return (None, None)
+
+        if operation.verbose:
+            print(f"[CLIENT] Received bytes: {response}")
+        if response.startswith(b"ERROR"):
+            return (response, response)
+        try:
+            return (InitSegment.deserialize(response, operation.verbose),
+                    response)
+        except ValueError:
+            pass
+        # Ecos tardíos de probes PMTU o datos antes que el INIT_ACK
+        if (operation.op_code == DOWNLOAD_OPERATION
+                and not ProbeSegment.is_probe(response)
+                and len(operation.early_data) < EARLY_DATA):
+            operation.early_data.append(response)
+
+
+def build_init(operation, version=INIT_VERSION) -> InitSegment:
+    """INIT with everything the client asks for. Version 0 is the
+    original format, it only carries the segment size"""
+    if not version:
+        return InitSegment(operation.op_code, operation.protocol_code, 0b0,
+                           operation.file_name,
+                           segment_size=operation.segment_size)
+    return InitSegment(operation.op_code, operation.protocol_code, 0b0,
+                       operation.file_name, 0b0, operation.segment_size,
+                       version, operation.file_size,
+                       operation.initial_window, operation.compression,
+                       operation.checksum, operation.resume_offset)
+
+
+def probe_path_mtu(operation) -> int:
+    """Largest segment size up to --segment-size that reaches the server
+    without fragmentation. Probes go out with DF set, binary search from
+    PMTU_FLOOR. If not even that is echoed (an older server) the size is
+    left as it was"""
+    largest = operation.segment_size
+    if largest <= PMTU_FLOOR:
+        return largest
+
+    if not operation.quiet:
+        print(f"[CLIENT] Probing path MTU up to {largest} bytes")
+    previous = set_dont_fragment(operation.socket)
+    try:
+        if send_probe(operation, largest):
+            return largest
+        if not send_probe(operation, PMTU_FLOOR):
+            print("[CLIENT] No answer to PMTU probes, "
+                  f"keeping {largest} bytes")
+            return largest
+
+        low, high = PMTU_FLOOR, largest - 1
+        while low < high:
+            size = (low + high + 1) // 2
+            if send_probe(operation, size):
+                low = size
+            else:
+                high = size - 1
+        if not operation.quiet:
+            print(f"[CLIENT] Path MTU allows {low} bytes")
+        return low
+    finally:
+        restore_fragment(operation.socket, previous)
+
+
+def send_probe(operation, size) -> bool:
+    """Whether a probe of size bytes is echoed by the server, up to
+    PMTU_ATTEMPTS tries"""
+    probe = ProbeSegment(size).serialize()
+    for _ in range(PMTU_ATTEMPTS):
+        try:
+            operation.socket.sendto(probe, operation.destination_address)
+        except OSError as e:
+            if e.errno == errno.EMSGSIZE:  # Más grande que la MTU local
+                return False
+            raise
+
+        deadline = time.monotonic() + PMTU_TIMEOUT
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            operation.socket.settimeout(remaining)
+            try:
+                response, _ = operation.socket.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                break
+            try:
+                reply = ProbeSegment.deserialize(response)
+            except ValueError:
+                return False  # El servidor no lo recibió entero
+            # Los ecos tardíos de probes anteriores se descartan
+            if reply.ack and reply.size == size:
+                return True
+    return False
+
+
+def set_dont_fragment(sock):
+    """Set DF on the probes (Linux only), returns the previous setting"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        previous = sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER,
+                        IP_PMTUDISC_PROBE)
+        return previous
+    except OSError:
+        return None
+
+
+def restore_fragment(sock, previous):
+    if previous is not None:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, previous)
@@ -2,30 +2,59 @@ from queue import Queue
 import queue
 import socket
 import threading
+import zlib
 from lib.utils.static import (
+    CHECKSUMS, COMPRESSIONS,
     get_protocol_from_args,
     get_protocol_code_from_protocol_str)
+from ..utils.batch_io import BatchReceiver
+from ..utils.buffer_pool import BufferPool, release_buffer
 from ..utils.file_manager import FileManager
+from ..utils.segments import is_handshake
 from ..utils.constants import (
-    APPEND_MODE, BUFFER_SIZE, DOWNLOAD_OPERATION,
-    EOF_MARKER, MAX_ATTEMPTS)
+    APPEND_MODE, BUFFER_SIZE, CLOSE_MARKER, COMPRESSION_ZLIB,
+    DOWNLOAD_OPERATION, EOF_MARKER, MAX_ATTEMPTS, STOP_AND_WAIT)
 
 
 class Downloader():
-    def __init__(self, args, is_client: bool):
+    def __init__(self, args, is_client: bool, sock=None):
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # sock: socket compartido del servidor, sino se abre uno propio
+        self.owns_socket = sock is None
+        self.socket = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.destination_address = (args.host, args.port)
         self.protocol_handler = get_protocol_from_args(
             args, self.socket, self.destination_address)
         self.data_queue = Queue()
+        # Segmentos entregados y escritos, cada uno lo cuenta un solo hilo
+        self.delivered = 0
+        self.written = 0
         self.error = None
         self.op_code = DOWNLOAD_OPERATION
         self.protocol_code = get_protocol_code_from_protocol_str(args.protocol)
+        if self.protocol_code != STOP_AND_WAIT:
+            # Lo que falta escribir reduce la ventana que anuncia SR
+            self.protocol_handler.backlog = self.unwritten
         self.file_name = args.name  # solo lo usa el cliente en init
         self.file_path = args.dst
         self.file_manager = FileManager(args.dst, APPEND_MODE)
         self.file_manager.open()
+        # Lo que pide el cliente en el INIT, --pmtu puede achicar el
+        # tamaño de segmento. Después valen los del INIT_ACK
+        self.segment_size = getattr(args, "segment_size", BUFFER_SIZE)
+        self.pmtu = getattr(args, "pmtu", False)
+        self.file_size = None  # Lo conoce el servidor
+        self.initial_window = getattr(args, "initial_window", None)
+        self.compression = COMPRESSIONS[getattr(args, "compress", "none")]
+        self.checksum = CHECKSUMS[getattr(args, "checksum", "crc32")]
+        self.decompressor = None  # Con --compress zlib
+        # Con --resume se sigue desde lo que ya se descargó
+        self.resume_offset = None
+        if getattr(args, "resume", False):
+            self.resume_offset = self.file_manager.file_size() or 0
+        # Datos que el servidor mandó antes de que llegara el INIT_ACK
+        self.early_data = []
+        self.init_ack = b""  # El aceptado, sus copias no son datos
         self.is_client = is_client
         self.verbose = args.verbose
         self.quiet = args.quiet
@@ -33,6 +62,22 @@ class Downloader():
         self.data_worker_thread.daemon = True
         self.data_worker_thread.start()
 
+    def apply_init(self, init_segment):
+        """Take the parameters agreed in the handshake: the file is kept
+        up to the resume offset and the rest is preallocated"""
+        self.protocol_handler.apply_init(init_segment)
+        self.compression = init_segment.compression
+        if self.compression == COMPRESSION_ZLIB:
+            self.decompressor = zlib.decompressobj()
+        offset = init_segment.resume_offset
+        if offset is None and self.resume_offset is not None:
+            offset = 0  # El servidor no retoma, se baja entero
+        if offset is not None:
+            self.file_manager.truncate(offset)
+        if init_segment.file_size is not None:
+            self.file_manager.preallocate(
+                init_segment.file_size - (offset or 0))
+
     def data_worker(self):
         """Worker thread that writes received data to file"""
         if self.verbose:
@@ -49,16 +94,35 @@ class Downloader():
                 if data_bytes is None:  # Signal to ignore
                     continue
 
+                if data_bytes is CLOSE_MARKER:  # Terminated before EOF
+                    break
+
                 if data_bytes is EOF_MARKER:
                     if not self.quiet:
                         print("[Downloader] Download complete")
+                    # Cerrar ya: si se pierde el FIN el archivo queda
+                    # completo en disco hasta que se desaloje la sesión
+                    self.file_manager.close()
                     break
 
-                self.file_manager.append(data_bytes)
+                # Run de (payload, datagrama) en orden: los payloads son
+                # vistas de los datagramas, que vuelven al pool recién
+                # después de escribirlos
+                payloads = [payload for payload, _ in data_bytes]
+                if self.decompressor is not None:
+                    payloads = list(map(self.decompressor.decompress,
+                                        payloads))
+                self.file_manager.append_many(payloads)
+                for _, datagram in data_bytes:
+                    release_buffer(datagram)
+                self.written += len(data_bytes)
 
         except Exception as e:
             self.error = f"Error writing file in download: {str(e)}"
 
+    def unwritten(self) -> int:
+        return self.delivered - self.written
+
     def protocol_worker(self, result_queue):
         """
         Worker thread that handles protocol and receives data
@@ -66,46 +130,71 @@ class Downloader():
         if self.verbose:
             print("[Downloader] Protocol worker start")
 
+        data_bytes = None
         try:
             data_bytes = self.protocol_handler.communication_queue.get()
-            data, is_repeated, is_eof = self.protocol_handler.receive_file(
-                data_bytes)
+            if data_bytes is CLOSE_MARKER:
+                result_queue.put(True)
+                return
 
-            if is_repeated:
-                data = None
+            # El protocolo se queda con data_bytes, vuelve en algún run
+            run, _, is_eof = self.protocol_handler.receive_file(data_bytes)
+            data_bytes = None
 
-            if is_eof:
-                data = EOF_MARKER
+            if run:
+                self.delivered += len(run)
+                self.data_queue.put(run)
+                # Con --rate se recibe a ese ritmo: la cola crece y el
+                # emisor se frena (ventana anunciada en SR, ACK más tarde
+                # en SW). Los duplicados no cuentan
+                self.protocol_handler.pacer.pace(
+                    sum(len(payload) for payload, _ in run))
 
-            self.data_queue.put(data)
+            # En SR el segmento que completa el archivo puede traer datos
+            if is_eof:
+                self.data_queue.put(EOF_MARKER)
 
             result_queue.put(is_eof)  # Siempre le mando, sino bloquea
 
         except Exception as e:
+            release_buffer(data_bytes)
             self.error = f"[Downloader] Protocol error: {str(e)}"
             self.data_queue.put("")  # Signal data worker to stop
+            result_queue.put(True)  # Stop whoever waits for the result
 
     def transfer(self, is_client=True):
         if is_client:
             self.transfer_for_client()
         else:
-            self.start_workers(queue.Queue())
+            # Server side runs on the session worker, no extra thread
+            result_queue = queue.Queue()
+            self.protocol_worker(result_queue)
+            return result_queue.get()
 
     def transfer_for_client(self):
         result_queue = queue.Queue()
+        # Los datagramas se reciben en buffers del pool, sin copias, del
+        # tamaño negociado
+        size = self.protocol_handler.segment_size
+        receiver = BatchReceiver(bufsize=size, pool=BufferPool(size=size))
         is_finished = False
         timeout_counter = 0
         self.socket.settimeout(5)  # timeout for server response
         try:
+            # Lo que se adelantó al INIT_ACK va primero, en orden
+            for data in self.early_data:
+                if not is_finished:
+                    is_finished = self.deliver(data, result_queue)
+            self.early_data = []
+
             while not is_finished:
                 try:
                     # Receive data
                     if not self.quiet:
                         print("[CLIENT] Waiting for data...")
-                    data, _ = self.socket.recvfrom(BUFFER_SIZE)
+                    datagrams = receiver.recv_batch(self.socket)
                     if not self.quiet:
                         print("[CLIENT] Processing data")
-                    self.protocol_handler.put_bytes(data)
                     # Reset timeout counter on successful receive
                     timeout_counter = 0
                 except socket.timeout:
@@ -121,20 +210,33 @@ class Downloader():
                               f" ({timeout_counter}/{MAX_ATTEMPTS})")
                     continue
 
-                self.start_workers(result_queue)
-
-                is_finished = result_queue.get()
+                for data, _ in datagrams:
+                    is_finished = self.deliver(data, result_queue)
+                    if is_finished:
+                        break
 
-            print("[CLIENT] Transfer complete")
+            if self.error is None:
+                print("[CLIENT] Transfer complete")
         except KeyboardInterrupt:
             print("\nClient interruption. Closing connection gracefully\n")
         finally:
-            self.file_manager.close()
+            self.close_file()
             self.socket.sendto(b"FIN", self.destination_address)
             if self.verbose:
                 print("[CLIENT] Sending FIN to server")
             self.socket.close()
 
+    def deliver(self, data, result_queue) -> bool:
+        """Hand a datagram to the protocol, whether the file is complete.
+        Leftovers from the handshake never reach it"""
+        if is_handshake(data, self.init_ack):
+            release_buffer(data)
+            return False
+        if not self.protocol_handler.put_bytes(data):
+            return False  # Nada encolado, ningún worker va a responder
+        self.start_workers(result_queue)
+        return result_queue.get()
+
     def start_workers(self, result_queue):
         protocol_thread = threading.Thread(target=self.protocol_worker,
                                            args=(result_queue,))
@@ -143,6 +245,14 @@ class Downloader():
 
         protocol_thread.start()
 
-    def terminate(self):
-        self.file_manager.close()
+    def close_file(self):
+        # Let the data worker flush what is queued before closing the file,
+        # the last payload and the EOF can arrive in the same batch
+        self.data_queue.put(CLOSE_MARKER)
         self.data_worker_thread.join(timeout=1)
+        self.file_manager.close()
+
+    def terminate(self):
+        self.close_file()
+        if self.owns_socket:
+            self.socket.close()  # Ya cerrado en el cliente, no hace nada
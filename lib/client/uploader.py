@@ -1,31 +1,42 @@
 import queue
+from ..utils.batch_io import BatchReceiver
 from ..utils.constants import (
-    BUFFER_SIZE, EOF_MARKER, READ_MODE, UPLOAD_OPERATION)
+    BUFFER_SIZE, COMPRESSION_ZLIB, EOF_MARKER, MAX_ATTEMPTS, READ_AHEAD,
+    READ_MODE, TIMEOUT, UPLOAD_OPERATION)
 from ..utils.file_manager import FileManager
+import errno
 import os
 from queue import Queue
 import socket
 import threading
 
+from lib.utils.compression import ChunkCompressor
+from lib.utils.segments import is_handshake
 from lib.utils.static import (
+    CHECKSUMS, COMPRESSIONS,
     get_protocol_from_args,
     get_protocol_code_from_protocol_str)
 
 
 class Uploader():
-    def __init__(self, args):
+    def __init__(self, args, sock=None):
 
         if not args.src or not os.path.exists(args.src):
             print(f"ERROR: Source file not found: {args.src}")
-            raise FileNotFoundError
+            raise FileNotFoundError(
+                errno.ENOENT, os.strerror(errno.ENOENT), args.src)
         if args.verbose:
             print(f"[Uploader] File {args.src} found for upload")
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # sock: socket compartido del servidor, sino se abre uno propio
+        self.owns_socket = sock is None
+        self.socket = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.destination_address = (args.host, args.port)
         self.protocol_handler = get_protocol_from_args(
             args, self.socket, self.destination_address)
-        self.data_queue = Queue()
+        # Acotada: el archivo se lee a medida que el protocolo lo envía
+        self.data_queue = Queue(maxsize=READ_AHEAD)
+        self.closed = False
         self.error = None
         self.op_code = UPLOAD_OPERATION
         self.protocol_code = get_protocol_code_from_protocol_str(args.protocol)
@@ -34,10 +45,32 @@ class Uploader():
         self.file_manager = FileManager(args.src, READ_MODE)
         self.file_manager.open()
         self.current_size_remaining = self.file_manager.file_size()
+        # Lo que pide el cliente en el INIT, --pmtu puede achicar el
+        # tamaño de segmento. Después valen los del INIT_ACK
+        self.segment_size = getattr(args, "segment_size", BUFFER_SIZE)
+        self.pmtu = getattr(args, "pmtu", False)
+        self.file_size = self.current_size_remaining
+        self.initial_window = getattr(args, "initial_window", None)
+        self.compression = COMPRESSIONS[getattr(args, "compress", "none")]
+        self.checksum = CHECKSUMS[getattr(args, "checksum", "crc32")]
+        # 0: que el servidor diga cuánto tiene de una subida anterior
+        self.resume_offset = 0 if getattr(args, "resume", False) else None
+        self.init_ack = b""  # El aceptado, sus copias no son ACKs
         self.verbose = args.verbose
         self.quiet = args.quiet
+        # Arranca con el INIT_ACK, cuando ya se sabe de qué tamaño leer
         self.data_worker_thread = threading.Thread(target=self.data_worker)
         self.data_worker_thread.daemon = True
+
+    def apply_init(self, init_segment):
+        """Take the parameters agreed in the handshake and start reading.
+        The server calls it before sending the INIT_ACK, so the first
+        window is already read when the session worker starts"""
+        self.protocol_handler.apply_init(init_segment)
+        self.compression = init_segment.compression
+        if init_segment.resume_offset:
+            self.file_manager.seek(init_segment.resume_offset)
+            self.current_size_remaining -= init_segment.resume_offset
         self.data_worker_thread.start()
 
     def data_worker(self):
@@ -46,13 +79,22 @@ class Uploader():
             print("[Uploader] Data worker start, "
                   f"reading from: {self.file_manager.path}")
         try:
-            data_size = BUFFER_SIZE - self.protocol_handler.header_size
-            while True:
+            data_size = self.protocol_handler.data_size
+            compressor = None
+            if self.compression == COMPRESSION_ZLIB:
+                compressor = ChunkCompressor(data_size)
+            while not self.closed:
                 if self.current_size_remaining > 0:
                     data = self.file_manager.read(data_size)
-                    self.data_queue.put(data)
                     self.current_size_remaining -= len(data)
+                    if compressor is None:
+                        self.data_queue.put(data)
+                        continue
+                    for chunk in compressor.chunks(data):
+                        self.data_queue.put(chunk)
                 else:
+                    for chunk in compressor.flush() if compressor else []:
+                        self.data_queue.put(chunk)
                     self.data_queue.put(EOF_MARKER)
                     break
 
@@ -68,22 +110,21 @@ class Uploader():
             print("[Uploader] Protocol worker start")
         try:
 
-            data = self.data_queue.get()
-            if data is None:
+            batch = self.next_batch()
+            if batch[0] is None:
                 result_queue.put(True)
+                return
 
             try:
-                if data is EOF_MARKER:
-                    # Send EOF packet
-                    self.protocol_handler.send(
-                        b"", eof=1)
-                    if self.verbose:
-                        print("[Uploader] Upload complete")
-                    result_queue.put(True)
-                else:
-                    self.protocol_handler.send(
-                        data, eof=0)
-                    result_queue.put(False)
+                # EOF_MARKER is always the last one, sent as an EOF packet
+                self.protocol_handler.send_many([
+                    (b"", 1) if data is EOF_MARKER else (data, 0)
+                    for data in batch
+                ])
+                is_eof = batch[-1] is EOF_MARKER
+                if is_eof and self.verbose:
+                    print("[Uploader] Upload complete")
+                result_queue.put(is_eof)
 
             except Exception as e:
                 if self.verbose:
@@ -96,37 +137,62 @@ class Uploader():
             self.error = f"Protocol error: {str(e)}"
             raise e
 
+    def next_batch(self):
+        """Chunks to send next: waits for the first one, then takes the
+        ones already read that still fit in the protocol window"""
+        batch = [self.data_queue.get()]
+        while (len(batch) < self.protocol_handler.free_window()
+               and batch[-1] is not EOF_MARKER):
+            try:
+                batch.append(self.data_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
     def transfer(self, is_client=True):
         result_queue = queue.Queue()
         if is_client:
             self.transfer_all_here(result_queue)
         else:
-            self.start_workers(result_queue)
-            result = result_queue.get()
-            return result
+            # Server side runs on the session worker, no extra thread
+            self.protocol_worker(result_queue)
+            return result_queue.get()
 
     def transfer_all_here(self, result_queue):
         is_finished = False
+        worker_running = False
+        receiver = BatchReceiver()
         self.socket.settimeout(5)  # timeout for server response
         try:
             while not is_finished:
-                self.start_workers(result_queue)
+                if not worker_running:
+                    self.start_workers(result_queue)
+                    worker_running = True
                 try:
                     # Receive data
                     if not self.quiet:
                         print("[CLIENT] Waiting for server response...")
-                    data, _ = self.socket.recvfrom(BUFFER_SIZE)
+                    datagrams = receiver.recv_batch(self.socket)
                     if not self.quiet:
                         print("[CLIENT] Proccesing response")
-                    self.protocol_handler.put_bytes(data)
+                    for data, _ in datagrams:
+                        if not is_handshake(data, self.init_ack):
+                            self.protocol_handler.put_bytes(data)
                 except socket.timeout:
                     if not self.quiet:
                         print("[CLIENT] TIMEOUT while waiting for "
                               "message on uploader...")
-                    continue
-                is_finished = result_queue.get()
-
-            print("[CLIENT] Transfer complete")
+                # El worker puede estar esperando lugar en la ventana, que
+                # solo liberan ACKs: no bloquearse acá sin seguir recibiendo
+                try:
+                    is_finished = result_queue.get(timeout=TIMEOUT)
+                    worker_running = False
+                except queue.Empty:
+                    pass
+
+            self.wait_for_acks(receiver)
+            if self.error is None:
+                print("[CLIENT] Transfer complete")
         except KeyboardInterrupt:
             print("\nClient interruption. Closing connection gracefully\n")
         finally:
@@ -136,6 +202,19 @@ class Uploader():
                 print("[CLIENT] Sending FIN to server")
             self.socket.close()
 
+    def wait_for_acks(self, receiver):
+        """Keep reading ACKs until every segment sent is confirmed, the FIN
+        must not overtake segments the server still has to receive"""
+        timeouts = 0
+        while (not self.protocol_handler.all_acked()
+               and timeouts < MAX_ATTEMPTS):
+            try:
+                for data, _ in receiver.recv_batch(self.socket):
+                    if not is_handshake(data, self.init_ack):
+                        self.protocol_handler.put_bytes(data)
+            except socket.timeout:
+                timeouts += 1
+
     def start_workers(self, result_queue):
         protocol_thread = threading.Thread(target=self.protocol_worker,
                                            args=(result_queue, ))
@@ -145,5 +224,15 @@ class Uploader():
         protocol_thread.start()
 
     def terminate(self):
+        self.closed = True
+        # El data worker puede estar esperando lugar en la cola
+        try:
+            while True:
+                self.data_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self.data_worker_thread.ident is not None:
+            self.data_worker_thread.join(timeout=1)
         self.file_manager.close()
-        self.data_worker_thread.join(timeout=1)
+        if self.owns_socket:
+            self.socket.close()  # Ya cerrado en el cliente, no hace nada
@@ -5,3 +5,18 @@ class MaxSendAttemptsExceeded(Exception):
 
 class PacketDuplicateOrCorrupted(Exception):
     pass
+
+
+# Raised when a protocol is stopped while a send is still waiting
+class ProtocolStopped(Exception):
+    pass
+
+
+# Raised by the server when a new transfer has to wait (busy reply)
+class ServerBusy(Exception):
+    pass
+
+
+# Raised by the server when it cannot take a new session
+class SessionLimitReached(ServerBusy):
+    pass
@@ -0,0 +1,9 @@
+from lib.protocols.async_selective_repeat import AsyncSelectiveRepeat
+from lib.protocols.forward_error_correction import ForwardErrorCorrection
+
+
+class AsyncForwardErrorCorrection(ForwardErrorCorrection,
+                                  AsyncSelectiveRepeat):
+    """Forward Error Correction driven by the event loop of the asyncio
+    engine: the parity of ForwardErrorCorrection on top of the loop
+    timers of AsyncSelectiveRepeat"""
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from lib.utils.constants import (
+    ACK_DELAY, ACK_EVERY, CONGESTION, RATE, WINDOW_SIZE)
+from lib.protocols.selective_repeat import SelectiveRepeat
+
+
+class AsyncSelectiveRepeat(SelectiveRepeat):
+    """Selective Repeat driven by the event loop of the asyncio engine.
+    Every segment in flight gets its own loop timer instead of being
+    polled by the retransmission thread"""
+
+    def __init__(self, socket_, address, verbose=False, quiet=True,
+                 window_size=WINDOW_SIZE, congestion=CONGESTION,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, rate=RATE):
+        # Timers pendientes por número de secuencia
+        self.timers = {}
+        # Timer del ACK demorado, si hay uno
+        self.ack_timer = None
+        # Se setea cuando un ACK libera lugar en la ventana
+        self.window_open = asyncio.Event()
+        super().__init__(socket_, address, verbose, quiet, window_size,
+                         congestion, ack_every, ack_delay, rate)
+        self.communication_queue = asyncio.Queue()
+
+    def start_retransmit_watcher(self):
+        # No hay hilo, cada segmento enviado programa su timer en el loop
+        self.retransmit_thread = None
+
+    async def send_async(self, payload, eof=0):
+        while self.window_full():
+            self.window_open.clear()
+            if self.peer_window > 0:
+                await self.window_open.wait()
+                continue
+            # Ventana cero: ningún ACK la va a abrir, se reintenta con un
+            # probe cada RTO
+            try:
+                await asyncio.wait_for(self.window_open.wait(), self.rtt.rto)
+            except asyncio.TimeoutError:
+                pass
+
+        wait = self.pacer.delay(len(payload) + self.header_size)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.send_segment(payload, eof)
+
+    def schedule_retransmit(self, seq):
+        timer = self.timers.pop(seq, None)
+        if timer is not None:  # Retransmisión rápida, el viejo ya no va
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.timers[seq] = loop.call_later(self.rtt.rto, self.on_timeout,
+                                           seq)
+
+    def on_timeout(self, seq):
+        self.timers.pop(seq, None)
+        if not self.running or not self.unacked(seq):
+            return
+
+        self.on_retransmit([seq])
+        slot = self.slot(seq)
+        self.pacer.charge(len(self.send_buffer[slot]))
+        self.socket.sendto(self.send_buffer[slot], self.address)
+        self.time_sent[slot] = time.monotonic()
+        self.retransmitted[slot] = True
+        self.stats.retransmitted(len(self.send_buffer[slot]))
+        self.rtt.backoff()
+        if self.verbose:
+            print(f"[SelectiveRepeat] Retransmitiendo seq={seq}")
+        self.schedule_retransmit(seq)
+
+    def schedule_ack(self):
+        self.ack_deadline = time.monotonic() + self.ack_delay
+        self.ack_timer = asyncio.get_running_loop().call_later(
+            self.ack_delay, self.on_ack_timeout)
+
+    def on_ack_timeout(self):
+        self.ack_timer = None
+        if self.running and self.ack_pending:
+            self.send_ack()
+            self.stats.acks_delayed += 1
+
+    def send_ack(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        super().send_ack()
+
+    def handle_ack(self, segment):
+        acked = super().handle_ack(segment)
+        for seq in acked:
+            timer = self.timers.pop(seq, None)
+            if timer is not None:
+                timer.cancel()
+        if not self.window_full():
+            self.window_open.set()
+        return acked
+
+    def stop(self):
+        self.running = False
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
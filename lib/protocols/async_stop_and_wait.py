@@ -0,0 +1,52 @@
+import asyncio
+import time
+from lib.utils.constants import MAX_ATTEMPTS, RATE
+from lib.protocols.stop_and_wait import StopAndWait
+
+
+class AsyncStopAndWait(StopAndWait):
+    """Stop and Wait driven by the event loop of the asyncio engine.
+    socket can be any object with sendto, like a DatagramTransport"""
+
+    def __init__(self, socket, address, verbose, quiet, rate=RATE):
+        super().__init__(socket, address, verbose, quiet, rate)
+        self.communication_queue = asyncio.Queue()  # Queue for receiving ACKs
+
+    async def send_async(self, payload, eof=0):  # Send a single package
+        serialized_packet = self.build_packet(payload, eof)
+        wait = self.pacer.delay(len(serialized_packet))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        while MAX_ATTEMPTS > self.send_attempts:
+
+            if self.verbose:
+                print(f"Sending SW packet: {serialized_packet}")
+
+            self.socket.sendto(serialized_packet, self.destination_address)
+            sent_at = self.count_sent(serialized_packet)
+
+            try:
+                first_attempt = self.send_attempts == 0
+                # Timer del event loop en lugar de Queue.get(timeout)
+                await asyncio.wait_for(self.wait_ack_async(),
+                                       timeout=self.rtt.rto)
+                if first_attempt:
+                    self.add_rtt_sample(time.monotonic() - sent_at)
+                return
+
+            except asyncio.TimeoutError:
+                if self.verbose:
+                    print("[StopAndWait] Timeout waiting for ACK")
+                self.rtt.backoff()
+
+            self.send_attempts += 1
+
+        raise self.max_attempts_error()
+
+    async def wait_ack_async(self):
+        """wait_ack for the event loop, the caller sets the timeout"""
+        while True:
+            ack_packet = await self.communication_queue.get()
+            if self.is_expected_ack(ack_packet):
+                return
@@ -0,0 +1,189 @@
+from lib.protocols.selective_repeat import SEQ_MASK, SelectiveRepeat
+from lib.utils.batch_io import sendmany
+from lib.utils.buffer_pool import release_buffer
+from lib.utils.constants import (
+    ACK_DELAY, ACK_EVERY, CONGESTION, FEC_BLOCK, FEC_HEADER_SIZE,
+    FEC_PARITY, HEADER_SIZE_SR, MAX_FEC_PENDING, RATE, RECV_WINDOW,
+    WINDOW_SIZE)
+from lib.utils.segments import SelectiveRepeatSegment as Segment
+
+
+def encode(payload, eof) -> int:
+    """Segment as the integer XORed into a parity: flags, length and
+    payload, little endian so shorter segments are padded with zeros"""
+    header = bytes([eof]) + len(payload).to_bytes(2, byteorder="big")
+    return int.from_bytes(header + bytes(payload), "little")
+
+
+def decode(value, length) -> tuple[bytes, int]:
+    """(payload, eof) of a segment rebuilt from a parity"""
+    data = value.to_bytes(length, "little")
+    payload_len = int.from_bytes(data[1:3], byteorder="big")
+    return data[3:3 + payload_len], data[0] & 0b1
+
+
+class ForwardErrorCorrection(SelectiveRepeat):
+    """Selective Repeat plus parity: after every block of data segments
+    the sender adds parity segments, the XOR of interleaved groups of
+    the block (group j holds the segments j, j + groups, ...). A receiver
+    missing a single segment of a group rebuilds it without waiting for
+    the retransmission, more losses fall back to Selective Repeat"""
+
+    def __init__(self, socket_, address, verbose=False, quiet=True,
+                 window_size=WINDOW_SIZE, congestion=CONGESTION,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, rate=RATE,
+                 block=FEC_BLOCK, parity=FEC_PARITY):
+        # Con tantos grupos como segmentos en el bloque cada uno va
+        # repetido. El tamaño del bloque viaja en un byte
+        self.block = max(1, min(block, 0xFF))
+        self.groups = max(1, min(parity, self.block))
+
+        # Paridad del bloque en curso por grupo, con el largo del mayor
+        self.parity = [0] * self.groups
+        self.parity_len = [0] * self.groups
+
+        # Paridades listas para salir detrás de sus datos
+        self.pending_parity = []
+
+        # Receptor: segmentos vistos codificados, como (seq, valor) por
+        # seq % RECV_WINDOW, y las paridades con más de un faltante
+        self.seen = [None] * RECV_WINDOW
+        self.waiting = {}
+
+        super().__init__(socket_, address, verbose, quiet, window_size,
+                         congestion, ack_every, ack_delay, rate)
+        # La paridad lleva flags y largo, los datos dejan ese lugar
+        self.header_size = HEADER_SIZE_SR + FEC_HEADER_SIZE
+
+    def send_segment(self, payload, eof=0) -> int:
+        seq = super().send_segment(payload, eof)
+        self.flush_parity()
+        return seq
+
+    def send_many(self, items):
+        # De a un bloque, así cada paridad sale detrás de sus datos
+        while items:
+            count = self.block - self.next_seq_num % self.block
+            super().send_many(items[:count])
+            items = items[count:]
+            self.flush_parity()
+
+    def track_segment(self, payload, eof=0):
+        seq, serialized = super().track_segment(payload, eof)
+        index = seq % self.block
+        group = index % self.groups
+        self.parity[group] ^= encode(payload, eof)
+        self.parity_len[group] = max(self.parity_len[group],
+                                     FEC_HEADER_SIZE + len(payload))
+        if index == self.block - 1 or eof:
+            self.close_block(seq - index, index + 1)
+        return seq, serialized
+
+    def close_block(self, base, size):
+        """Build the parity of the block of size segments from base"""
+        for group in range(min(self.groups, size)):
+            segment = Segment(
+                payload=self.parity[group].to_bytes(
+                    self.parity_len[group], "little"),
+                seq_num=base,  # Se trunca a 16 bits
+                ack_num=group,
+                win_size=(size << 8) | self.groups,
+                parity=1
+            )
+            self.pending_parity.append(segment.serialize(crc=self.crc))
+        self.parity = [0] * self.groups
+        self.parity_len = [0] * self.groups
+
+    def flush_parity(self):
+        if not self.pending_parity:
+            return
+        packets, self.pending_parity = self.pending_parity, []
+        if self.verbose:
+            print(f"[FEC] Enviando {len(packets)} segmentos de paridad")
+        sendmany(self.socket, packets, self.address)
+        self.pacer.charge(sum(map(len, packets)))
+        self.stats.sent(sum(map(len, packets)), len(packets))
+        self.stats.fec_parity += len(packets)
+
+    def receive_file(self, data_bytes) -> tuple[list, bool, bool]:
+        try:
+            segment = Segment.deserialize(data_bytes, self.crc)
+        except ValueError as e:
+            print(f"[FEC] Error: {e}")
+            release_buffer(data_bytes)
+            return ([], False, False)
+
+        if segment.parity:
+            release_buffer(data_bytes)
+            base = self.unwrap(segment.seq_num, self.expected_seq_num)
+            size, groups = segment.win_size >> 8, segment.win_size & 0xFF
+            covered = range(base + segment.ack_num, base + size, groups)
+            value = int.from_bytes(segment.payload, "little")
+            entry = (covered, value, len(segment.payload))
+            return self.receive_rebuilt(self.rebuild(*entry, store=True))
+
+        self.remember(segment)
+        run, is_repeated, all_received = self.receive_segment(
+            segment, data_bytes)
+        rebuilt, _, all_received = self.receive_rebuilt(
+            self.rebuild_waiting())
+        return (run + rebuilt, is_repeated, all_received)
+
+    def receive_rebuilt(self, rebuilt) -> tuple[list, bool, bool]:
+        """Hand a rebuilt (seq, payload, eof) to Selective Repeat, as if
+        it had arrived"""
+        if rebuilt is None:
+            return ([], False, self.all_received())
+        seq, payload, eof = rebuilt
+        self.stats.fec_recovered += 1
+        if self.verbose:
+            print(f"[FEC] Reconstruido seq={seq}")
+        segment = Segment(payload=payload, seq_num=seq & SEQ_MASK,
+                          eof_num=eof)
+        self.remember(segment)
+        return self.receive_segment(segment, payload)
+
+    def remember(self, segment):
+        seq = self.unwrap(segment.seq_num, self.expected_seq_num)
+        if 0 <= seq - self.expected_seq_num < RECV_WINDOW:
+            self.seen[seq % RECV_WINDOW] = (
+                seq, encode(segment.payload, segment.eof_num))
+
+    def has_segment(self, seq) -> bool:
+        offset = seq - self.expected_seq_num
+        return offset < 0 or (offset < RECV_WINDOW and self.recv_ring[
+            seq % RECV_WINDOW] is not None)
+
+    def rebuild(self, covered, value, length, store=False):
+        """The only missing segment of a parity group as (seq, payload,
+        eof), None if none or several are missing. With store a parity
+        missing several waits for the retransmissions"""
+        missing = [seq for seq in covered if not self.has_segment(seq)]
+        if len(missing) != 1:
+            if len(missing) > 1 and store:
+                if len(self.waiting) >= MAX_FEC_PENDING:
+                    self.waiting.pop(next(iter(self.waiting)))
+                self.waiting[covered] = (covered, value, length)
+            return None
+        for seq in covered:
+            if seq == missing[0]:
+                continue
+            seen = self.seen[seq % RECV_WINDOW]
+            if seen is None or seen[0] != seq:
+                return None  # Ya se pisó, queda la retransmisión
+            value ^= seen[1]
+        payload, eof = decode(value, length)
+        return (missing[0], payload, eof)
+
+    def rebuild_waiting(self):
+        """A segment rebuilt from a parity that was waiting for data"""
+        for key, entry in list(self.waiting.items()):
+            covered = entry[0]
+            if all(map(self.has_segment, covered)):
+                del self.waiting[key]
+                continue
+            rebuilt = self.rebuild(*entry)
+            if rebuilt is not None:
+                del self.waiting[key]
+                return rebuilt
+        return None
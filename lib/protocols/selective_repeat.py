@@ -1,12 +1,28 @@
+import heapq
 import queue
 import threading
 import time
-from lib.utils.constants import HEADER_SIZE_SR, TIMEOUT
+from lib.exceptions import ProtocolStopped
+from lib.utils.batch_io import sendmany
+from lib.utils.buffer_pool import release_buffer
+from lib.utils.congestion import get_congestion_control
+from lib.utils.constants import (
+    ACK_DELAY, ACK_EVERY, BUFFER_SIZE, CHECKSUM_CRC32, CONGESTION,
+    DUP_THRESH, HEADER_SIZE_SR, MAX_ACK_DELAY, PACING_GAIN, RATE, RECV_WINDOW,
+    WINDOW_SIZE)
+from lib.utils.metrics import SessionStats
+from lib.utils.rtt_estimator import RttEstimator
 from lib.utils.segments import SelectiveRepeatSegment as Segment
+from lib.utils.token_bucket import TokenBucket
+
+SEQ_BITS = 16  # Los seq viajan en 16 bits, cada lado los desenvuelve
+SEQ_MASK = (1 << SEQ_BITS) - 1
 
 
 class SelectiveRepeat:
-    def __init__(self, socket_, address, verbose=False, quiet=True):
+    def __init__(self, socket_, address, verbose=False, quiet=True,
+                 window_size=WINDOW_SIZE, congestion=CONGESTION,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, rate=RATE):
         self.socket = socket_
         self.address = address
         self.verbose = verbose
@@ -14,8 +30,10 @@ class SelectiveRepeat:
 
         self.header_size = HEADER_SIZE_SR
 
-        # Tamaño de la ventana deslizante
-        self.window_size = 4
+        # Tamaño de los datagramas y si llevan CRC, lo fija el INIT de la
+        # sesión
+        self.segment_size = BUFFER_SIZE
+        self.crc = True
 
         # El paquete con num secuencia más chico sin ACK recibido
         self.send_base = 0
@@ -23,20 +41,95 @@ class SelectiveRepeat:
         # El siguiente número de secuencia
         self.next_seq_num = 0
 
-        # Buffer con los paquetes serializados ya enviados
-        self.send_buffer = {}
+        # Ventana de envío: anillos indexados por seq % capacity, un slot
+        # vale para los seqs entre send_base y next_seq_num. Nunca hay más
+        # en vuelo que window_size, el tope de la ventana de congestión
+        self.capacity = max(1, window_size)
+
+        # Paquetes serializados enviados y sin confirmar en orden
+        self.send_buffer = [None] * self.capacity
+
+        # Cuándo se envió (o retransmitió) cada paquete
+        self.time_sent = [0.0] * self.capacity
+
+        # ACKs recibidos
+        self.ack_received = [False] * self.capacity
+
+        # Retransmitidos, su ACK no sirve como muestra de RTT (Karn)
+        self.retransmitted = [False] * self.capacity
+
+        # Deadline vigente de cada paquete, las entradas del heap que no
+        # coinciden quedaron viejas por una retransmisión rápida
+        self.deadline_at = [0.0] * self.capacity
+
+        # El seq más alto confirmado, los sin ACK debajo son un hueco
+        self.highest_acked = -1
+
+        # Heap de (deadline, seq) por retransmitir, el watcher duerme hasta
+        # el primero. Los de seqs ya confirmados se descartan al salir
+        self.deadlines = []
 
-        # Buffer con Timer para cada paquete
-        self.time_sent = {}
+        # Protege los buffers de envío entre quien envía, quien recibe los
+        # ACKs y el watcher, que espera en ella hasta el próximo deadline.
+        # Del lado receptor protege el anillo que lee un ACK demorado
+        lock = threading.RLock()
+        self.send_lock = threading.Condition(lock)
 
-        # Buffer con ACKs recibidos
-        self.ack_received = {}
+        # Con el mismo lock, la avisa cada ACK al emisor que espera lugar
+        # en la ventana
+        self.window_free = threading.Condition(lock)
+
+        # Contadores para las métricas
+        self.stats = SessionStats()
+
+        # Timeout de retransmisión, se adapta al RTT medido. El receptor
+        # puede retener un ACK hasta MAX_ACK_DELAY, que se suma al RTO
+        self.rtt = RttEstimator(self.stats, MAX_ACK_DELAY)
+
+        # Ventana de congestión (segmentos en vuelo), window_size es su tope
+        self.congestion = get_congestion_control(
+            congestion, window_size, self.stats)
+
+        # Pacing de los envíos: una tasa fija, o con "auto" la ventana de
+        # congestión repartida en el RTT (se actualiza con cada ACK)
+        self.auto_pace = rate == "auto"
+        self.pacer = TokenBucket(0 if self.auto_pace else rate)
+        self.stats.rate = self.pacer.rate
+
+        # Espacio libre que anunció el receptor en el último ACK
+        self.peer_window = RECV_WINDOW
+
+        # Cuándo llegó el último ACK, para los probes con ventana cero
+        self.last_ack = time.monotonic()
 
         # El siguiente número de secuencia que un receptor espera (ordenado)
         self.expected_seq_num = 0
 
-        # Buffer de paquetes que llegaron pero no están ordenados (seq number)
-        self.recv_buffer = {}
+        # Anillo de reorden indexado por seq % RECV_WINDOW: los segmentos
+        # que llegaron antes de tiempo, como (payload, datagrama) sin copiar
+        self.recv_ring = [None] * RECV_WINDOW
+        self.buffered = 0
+
+        # Tope de la ventana anunciada: el servidor lo baja a su
+        # --max-inflight, así también limita lo que le suben
+        self.recv_limit = RECV_WINDOW
+
+        # Política de ACKs: uno cada ack_every segmentos en orden o a los
+        # ack_delay segundos, lo que pase primero. Huecos, duplicados y el
+        # EOF se confirman enseguida. El emisor espera hasta MAX_ACK_DELAY
+        self.ack_every = max(1, ack_every)
+        self.ack_delay = min(ack_delay, MAX_ACK_DELAY)
+        self.stats.ack_every = self.ack_every
+        self.stats.ack_delay = self.ack_delay
+
+        # Segmentos recibidos desde el último ACK, y cuándo sale el ACK
+        # demorado que los confirma (lo manda el watcher)
+        self.ack_pending = 0
+        self.ack_deadline = None
+
+        # Segmentos entregados que todavía no se escribieron, lo setea el
+        # Downloader; cuentan contra RECV_WINDOW como los del anillo
+        self.backlog = lambda: 0
 
         # Cola interna para almacenar datagramas UDP entrantes (solo DATA)
         self.communication_queue = queue.Queue()
@@ -48,115 +141,450 @@ class SelectiveRepeat:
         self.running = True
 
         # Hilo para retransmisión
+        self.retransmit_thread = None
+        self.start_retransmit_watcher()
+
+    def start_retransmit_watcher(self):
         self.retransmit_thread = threading.Thread(
             target=self.retransmit_watcher, daemon=True)
         self.retransmit_thread.start()
 
+    def apply_init(self, init_segment):
+        """Take the parameters agreed in the handshake"""
+        self.segment_size = init_segment.segment_size
+        self.crc = init_segment.checksum == CHECKSUM_CRC32
+        if init_segment.initial_window is not None:
+            self.congestion.restart(init_segment.initial_window)
+
+    @property
+    def data_size(self) -> int:
+        """Payload bytes that fit in a segment of the session"""
+        return self.segment_size - self.header_size
+
+    def send_window(self) -> int:
+        """Segments allowed in flight: the congestion window capped by the
+        free space the receiver advertised. With a zero window a single
+        probe segment goes out once per RTO, its ACK has the new window"""
+        window = min(self.congestion.window, self.peer_window)
+        if (window == 0 and self.all_acked()
+                and time.monotonic() - self.last_ack >= self.rtt.rto):
+            return 1
+        return window
+
+    def window_full(self):
+        return self.next_seq_num >= self.send_base + self.send_window()
+
+    def free_window(self):
+        """Segments that can be sent now, at least 1 (that one waits)"""
+        return max(1, self.send_base + self.send_window()
+                   - self.next_seq_num)
+
+    def slot(self, seq) -> int:
+        return seq % self.capacity
+
+    def unacked(self, seq) -> bool:
+        """seq was sent and is still waiting for its ACK"""
+        return (self.send_base <= seq < self.next_seq_num
+                and not self.ack_received[self.slot(seq)])
+
+    @staticmethod
+    def unwrap(seq16, reference) -> int:
+        """Full seq with these low 16 bits closest to reference"""
+        diff = (seq16 - reference) & SEQ_MASK
+        if diff > SEQ_MASK >> 1:
+            diff -= SEQ_MASK + 1
+        return reference + diff
+
+    def all_acked(self):
+        return self.send_base >= self.next_seq_num
+
+    def wait_window(self) -> int:
+        """Block until the window has room, returns how many segments fit
+        (at least 1), fails once stopped. Every ACK wakes it up; with a
+        zero window and nothing in flight no ACK is coming, it wakes up
+        when the probe is due"""
+        with self.send_lock:
+            while self.window_full():
+                if not self.running:
+                    raise ProtocolStopped("Selective Repeat stopped")
+                timeout = None
+                # Con segmentos sin ACK sus retransmisiones traen la
+                # ventana nueva: sin timeout, con 0 s giraría sin parar
+                if self.peer_window == 0 and self.all_acked():
+                    timeout = max(0.0, self.last_ack + self.rtt.rto
+                                  - time.monotonic())
+                self.window_free.wait(timeout)
+            # Bajo el lock: un ACK puede achicar cwnd o la ventana anunciada
+            return max(1, self.send_base + self.send_window()
+                       - self.next_seq_num)
+
     def send(self, payload, eof=0):
-        while self.next_seq_num >= self.send_base + self.window_size:
-            time.sleep(0.01)
+        self.wait_window()
+        self.pacer.pace(len(payload) + self.header_size)
+        self.send_segment(payload, eof)
+
+    def send_many(self, items):
+        """Send (payload, eof) items, every burst that fits in the window
+        goes out with a single sendmany call"""
+        while items:
+            room = self.wait_window()
+            if self.pacer.rate:  # Ráfagas de a lo que deja el pacing
+                fits = self.pacer.burst // self.segment_size
+                room = min(room, max(1, fits))
+            burst, items = items[:room], items[room:]
+            self.pacer.pace(sum(len(payload) + self.header_size
+                                for payload, _ in burst))
+            packets = [self.track_segment(payload, eof)[1]
+                       for payload, eof in burst]
+            sendmany(self.socket, packets, self.address)
+            self.stats.sent(sum(map(len, packets)), len(packets))
+
+    def send_segment(self, payload, eof=0) -> int:
+        """Serialize, buffer and send the next segment, returns its seq"""
+        seq, serialized = self.track_segment(payload, eof)
+        self.socket.sendto(serialized, self.address)
+        self.stats.sent(len(serialized))
+        return seq
 
+    def track_segment(self, payload, eof=0):
+        """Serialize the next segment and keep it for retransmission,
+        returns (seq, serialized)"""
         segment = Segment(
             payload=payload,
-            seq_num=self.next_seq_num,  # SIN mod 256, usamos 16 bits
+            seq_num=self.next_seq_num,  # Se trunca a 16 bits
             ack_num=0,
-            win_size=self.window_size,
+            win_size=self.congestion.window,
             eof_num=eof
         )
-        serialized = segment.serialize()
+        serialized = segment.serialize(crc=self.crc)
 
-        seq = self.next_seq_num
-        self.send_buffer[seq] = serialized
-        self.time_sent[seq] = time.time()
-        self.ack_received[seq] = False
+        with self.send_lock:
+            seq = self.next_seq_num
+            slot = self.slot(seq)
+            self.send_buffer[slot] = serialized
+            self.time_sent[slot] = time.monotonic()
+            self.ack_received[slot] = False
+            self.retransmitted[slot] = False
+            self.next_seq_num += 1
+            self.schedule_retransmit(seq)
 
         if self.verbose:
             print(f"[SelectiveRepeat] Enviando seq={seq}, eof={eof}")
 
-        self.socket.sendto(serialized, self.address)
-        self.next_seq_num += 1
+        return seq, serialized
 
-    def handle_ack(self, segment: Segment):
-        ack_num = segment.ack_num
-        for seq in self.send_buffer:
-            if ack_num == seq:
-                self.ack_received[seq] = True
-                if self.verbose:
-                    print(f"[SelectiveRepeat] ACK recibido para seq={seq}")
-                while self.ack_received.get(self.send_base, False):
-                    self.send_base += 1
-                break
+    def schedule_retransmit(self, seq):
+        """Retransmit seq unless it is acknowledged within an RTO"""
+        with self.send_lock:
+            entry = (self.time_sent[self.slot(seq)] + self.rtt.rto, seq)
+            self.deadline_at[self.slot(seq)] = entry[0]
+            heapq.heappush(self.deadlines, entry)
+            if self.deadlines[0] == entry:  # Antes que lo que esperaba
+                self.send_lock.notify()
+
+    def handle_ack(self, segment: Segment) -> list:
+        """Apply a cumulative ACK plus SACK bitmap, returns the seqs it
+        confirms for the first time"""
+        with self.send_lock:
+            self.last_ack = time.monotonic()
+            self.peer_window = segment.win_size
+            self.stats.rwnd = segment.win_size
+            acked = self.newly_acked(segment)
+            if acked:  # Si no, duplicado: a lo sumo trae otra ventana
+                self.confirm(acked)
+            # Hay lugar nuevo (o cambió la ventana anunciada), sigue el
+            # emisor si estaba bloqueado
+            self.window_free.notify()
+            return acked
+
+    def confirm(self, acked):
+        """Mark acked as received, slide the window over the ones in order
+        and fast retransmit the gaps left behind"""
+        rtt = self.sample_rtt(acked)
+        for seq in acked:
+            self.ack_received[self.slot(seq)] = True
+            self.congestion.on_ack(rtt)
+        if self.verbose:
+            print(f"[SelectiveRepeat] ACK recibido para seqs={acked}")
+        while (self.send_base < self.next_seq_num
+               and self.ack_received[self.slot(self.send_base)]):
+            # Confirmado en orden, el slot queda libre
+            self.send_buffer[self.slot(self.send_base)] = None
+            self.send_base += 1
+        self.highest_acked = max(self.highest_acked, max(acked))
+        if self.auto_pace and self.rtt.srtt:
+            self.pacer.rate = (PACING_GAIN * self.congestion.window
+                               * self.segment_size / self.rtt.srtt)
+            self.stats.rate = self.pacer.rate
+        lost = self.lost_segments()
+        if lost:
+            self.fast_retransmit(lost)
+
+    def newly_acked(self, segment: Segment) -> list:
+        """Unacknowledged seqs below the cumulative ACK or with their bit
+        set in the bitmap (bit i is cumulative + 1 + i)"""
+        cumulative = min(self.unwrap(segment.ack_num, self.send_base),
+                         self.next_seq_num)
+        acked = [seq for seq in range(self.send_base, cumulative)
+                 if not self.ack_received[self.slot(seq)]]
+        bits = int.from_bytes(segment.payload, "little")
+        seq = cumulative + 1
+        while bits:
+            if bits & 1 and self.unacked(seq):
+                acked.append(seq)
+            bits >>= 1
+            seq += 1
+        return acked
+
+    def sample_rtt(self, acked) -> float:
+        """RTT of the newest segment confirmed that was sent once (Karn),
+        None if every one was retransmitted"""
+        fresh = [seq for seq in acked
+                 if not self.retransmitted[self.slot(seq)]]
+        if not fresh:
+            return None
+        rtt = time.monotonic() - self.time_sent[self.slot(max(fresh))]
+        self.stats.add_rtt(rtt)
+        self.rtt.sample(rtt)
+        return rtt
+
+    def lost_segments(self) -> list:
+        """Unacked seqs with at least DUP_THRESH acked segments above them,
+        only if they were sent once: a lost retransmission waits for its
+        timeout. With fewer segments in flight than that the threshold
+        drops to what can still be acked (early retransmit)"""
+        in_flight = self.next_seq_num - self.send_base
+        threshold = max(1, min(DUP_THRESH, in_flight - 1))
+        lost = []
+        above = 0
+        for seq in range(self.highest_acked, self.send_base - 1, -1):
+            slot = self.slot(seq)
+            if self.ack_received[slot]:
+                above += 1
+            elif above >= threshold and not self.retransmitted[slot]:
+                lost.append(seq)
+        lost.reverse()
+        return lost
+
+    def fast_retransmit(self, seqs):
+        """Resend seqs before their timeout, with send_lock held. A loss
+        halves the window but the RTO is kept, the path is still
+        delivering segments"""
+        self.congestion.on_loss(seqs[0], self.next_seq_num)
+        now = time.monotonic()
+        packets = []
+        for seq in seqs:
+            slot = self.slot(seq)
+            self.time_sent[slot] = now
+            self.retransmitted[slot] = True
+            self.schedule_retransmit(seq)
+            packets.append(self.send_buffer[slot])
+
+        if self.verbose:
+            print(f"[SelectiveRepeat] Retransmisión rápida seqs={seqs}")
+        self.pacer.charge(sum(map(len, packets)))
+        sendmany(self.socket, packets, self.address)
+        self.stats.retransmitted(sum(map(len, packets)), len(seqs))
+        self.stats.fast_retransmits += len(seqs)
+
+    def on_retransmit(self, seqs):
+        """Congestion response to a burst of timed out segments"""
+        if any(self.retransmitted[self.slot(seq)] for seq in seqs):
+            self.congestion.on_timeout(self.next_seq_num)
+        else:
+            self.congestion.on_loss(min(seqs), self.next_seq_num)
 
     def retransmit_watcher(self):
+        """Sleep until the earliest deadline, then resend every segment
+        due and still unacknowledged in a single burst"""
         while self.running:
-            now = time.time()
-            for seq in list(self.send_buffer):
-                if not self.ack_received.get(seq, False):
-                    if now - self.time_sent[seq] > TIMEOUT:
-                        self.socket.sendto(self.send_buffer[seq], self.address)
-                        self.time_sent[seq] = now
-                        if self.verbose:
-                            print("[SelectiveRepeat] Retransmitiendo "
-                                  f"seq={seq}")
-            time.sleep(0.01)
-
-    def put_bytes(self, data: bytes):
+            with self.send_lock:
+                if (self.ack_deadline is not None
+                        and self.ack_deadline <= time.monotonic()):
+                    self.send_ack()
+                    self.stats.acks_delayed += 1
+                due = self.pop_due()
+                if not due:
+                    # Sin deadlines lo despierta un envío o un ACK demorado
+                    self.send_lock.wait(self.next_wakeup())
+                    continue
+                self.on_retransmit(due)
+                self.rtt.backoff()
+                packets = [self.send_buffer[self.slot(seq)] for seq in due]
+                now = time.monotonic()
+                for seq in due:
+                    self.time_sent[self.slot(seq)] = now
+                    self.retransmitted[self.slot(seq)] = True
+                    self.schedule_retransmit(seq)
+
+            if self.verbose:
+                print(f"[SelectiveRepeat] Retransmitiendo seqs={due}")
+            # Toda la ráfaga de retransmisiones en una llamada, sin esperar
+            # al pacing pero descontando de lo que sigue
+            self.pacer.charge(sum(map(len, packets)))
+            sendmany(self.socket, packets, self.address)
+            self.stats.retransmitted(sum(map(len, packets)), len(due))
+
+    def next_wakeup(self):
+        """Seconds until the next retransmission or delayed ACK is due,
+        None if there is none"""
+        deadlines = [self.deadlines[0][0]] if self.deadlines else []
+        if self.ack_deadline is not None:
+            deadlines.append(self.ack_deadline)
+        if not deadlines:
+            return None
+        return min(deadlines) - time.monotonic()
+
+    def pop_due(self) -> list:
+        """Seqs whose deadline passed and are still unacknowledged"""
+        now = time.monotonic()
+        due = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, seq = heapq.heappop(self.deadlines)
+            if (self.unacked(seq)
+                    and self.deadline_at[self.slot(seq)] == deadline):
+                due.append(seq)
+        return due
+
+    def put_bytes(self, data: bytes) -> bool:
+        """Whether data was queued for receive_file: ACKs are handled
+        here and broken segments dropped"""
+        self.stats.received(len(data))
         try:
-            segment = Segment.deserialize(data)
-            if segment.payload == b"" and segment.eof_num == 0:
+            try:
+                segment = Segment.deserialize(data, self.crc)
+            except ValueError:
+                self.stats.crc_failures += 1
+                raise
+            if segment.sack:
                 self.handle_ack(segment)
+                release_buffer(data)
+                return False
             else:
                 if self.verbose:
                     print(f"[SelectiveRepeat] Putting {len(segment.payload)} "
                           "bytes into communication queue")
-                self.communication_queue.put(data)
+                self.communication_queue.put_nowait(data)
+                return True
         except Exception as e:
+            release_buffer(data)
             if self.verbose:
                 print("[SelectiveRepeat] Error al procesar "
                       f"segmento entrante: {e}")
+            return False
 
-    def receive_file(self, data_bytes) -> tuple[bytes, bool, bool]:
+    def receive_file(self, data_bytes) -> tuple[list, bool, bool]:
+        """Handle a DATA segment and ACK it, returns (run, is_repeated,
+        all_received). run holds the (payload, datagram) pairs that are
+        now in order: this segment and the buffered ones that were
+        waiting for it. The datagram is taken: it comes back in a run to
+        be released after writing it, or is released here"""
         try:
-            segment = Segment.deserialize(data_bytes)
-            seq = segment.seq_num
-            is_eof_flag = segment.eof_num == 1
-            cond = seq < self.expected_seq_num or seq in self.recv_buffer
-            is_repeated = cond
+            segment = Segment.deserialize(data_bytes, self.crc)
+        except ValueError as e:
+            print(f"[SelectiveRepeat] Error: {e}")
+            release_buffer(data_bytes)
+            return ([], False, False)
+        return self.receive_segment(segment, data_bytes)
 
-            if self.verbose:
-                print("[SelectiveRepeat] Recibido "
-                      f"seq={seq}, eof={is_eof_flag}, repetido={is_repeated}")
+    def receive_segment(self, segment,
+                        data_bytes) -> tuple[list, bool, bool]:
+        """receive_file once data_bytes was deserialized into segment"""
+        seq = self.unwrap(segment.seq_num, self.expected_seq_num)
+        offset = seq - self.expected_seq_num
+        if offset >= RECV_WINDOW:
+            # Más allá del espacio anunciado, sin ACK: se retransmite
+            release_buffer(data_bytes)
+            return ([], False, False)
 
-            if is_eof_flag:
-                self.final_seq_num = seq
+        slot = seq % RECV_WINDOW
+        is_eof_flag = segment.eof_num == 1
+        is_repeated = offset < 0 or self.recv_ring[slot] is not None
 
+        if self.verbose:
+            print("[SelectiveRepeat] Recibido "
+                  f"seq={seq}, eof={is_eof_flag}, repetido={is_repeated}")
+
+        if is_eof_flag:
+            self.final_seq_num = seq
+
+        run = []
+        with self.send_lock:
             if is_repeated:
+                self.stats.duplicates += 1
+                release_buffer(data_bytes)
                 if self.verbose:
                     print("[SelectiveRepeat] Ignorando "
                           f"paquete duplicado seq={seq}")
             else:
-                if seq == self.expected_seq_num:
+                self.recv_ring[slot] = (segment.payload, data_bytes)
+                self.buffered += 1
+                # Si llenó el hueco sale junto con lo que lo esperaba
+                slot = self.expected_seq_num % RECV_WINDOW
+                while self.recv_ring[slot] is not None:
+                    run.append(self.recv_ring[slot])
+                    self.recv_ring[slot] = None
+                    self.buffered -= 1
                     self.expected_seq_num += 1
-                    while self.expected_seq_num in self.recv_buffer:
-                        self.recv_buffer.pop(self.expected_seq_num)
-                        self.expected_seq_num += 1
-                elif seq > self.expected_seq_num:
-                    self.recv_buffer[seq] = segment
-
-            ack = Segment(ack_num=seq)
-            self.socket.sendto(ack.serialize(), self.address)
-
-            all_received = (
-                self.final_seq_num is not None
-                and self.final_seq_num < self.expected_seq_num
-                and not self.recv_buffer
-            )
-            return (segment.payload, is_repeated, all_received)
+                    slot = self.expected_seq_num % RECV_WINDOW
 
-        except Exception as e:
-            print(f"[SelectiveRepeat] Error: {e}")
-            return (b"", False, False)
+            # Un hueco (abierto, cerrado o pendiente), un duplicado o el EOF
+            # se confirman ya: el emisor necesita saberlo cuanto antes
+            self.ack_pending += 1
+            urgent = (is_repeated or is_eof_flag or len(run) != 1
+                      or self.buffered > 0)
+            if (urgent or self.ack_pending >= self.ack_every
+                    or self.ack_delay <= 0):
+                self.send_ack()
+            elif self.ack_deadline is None:
+                self.schedule_ack()
+
+        return (run, is_repeated, self.all_received())
+
+    def all_received(self) -> bool:
+        return (self.final_seq_num is not None
+                and self.final_seq_num < self.expected_seq_num)
+
+    def send_ack(self):
+        """Cumulative ACK plus SACK bitmap for everything received so far,
+        with send_lock held"""
+        ack = Segment(payload=self.sack_bitmap(),
+                      ack_num=self.expected_seq_num,
+                      win_size=self.advertised_window(), sack=1)
+        ack_bytes = ack.serialize(crc=self.crc)
+        self.socket.sendto(ack_bytes, self.address)
+        self.stats.sent(len(ack_bytes))
+        self.stats.acks_out += 1
+        self.ack_pending = 0
+        self.ack_deadline = None
+
+    def schedule_ack(self):
+        """Hold the ACK for ack_delay, with send_lock held"""
+        self.ack_deadline = time.monotonic() + self.ack_delay
+        self.send_lock.notify()
+
+    def sack_bitmap(self) -> bytes:
+        """Bit i set: seq expected_seq_num + 1 + i is in the ring"""
+        if not self.buffered:
+            return b""
+        bits = 0
+        last = 0
+        for i in range(1, RECV_WINDOW):
+            if self.recv_ring[(self.expected_seq_num + i) % RECV_WINDOW]:
+                bits |= 1 << (i - 1)
+                last = i
+        return bits.to_bytes((last + 7) // 8, "little")
+
+    def advertised_window(self) -> int:
+        """Free receive buffer, in segments, announced in every ACK"""
+        used = (self.buffered + self.communication_queue.qsize()
+                + self.backlog())
+        return max(0, min(RECV_WINDOW - used, self.recv_limit))
 
     def stop(self):
         self.running = False
-        self.retransmit_thread.join(timeout=1)
+        with self.send_lock:
+            self.send_lock.notify_all()
+            self.window_free.notify_all()
+        if self.retransmit_thread is not None:
+            self.retransmit_thread.join(timeout=1)
@@ -1,12 +1,18 @@
+import time
 from queue import Queue, Empty
+from lib.utils.buffer_pool import release_buffer
 from lib.utils.constants import (
-    BUFFER_SIZE, HEADER_SIZE_SW, TIMEOUT, MAX_ATTEMPTS)
+    BUFFER_SIZE, CHECKSUM_CRC32, CLOSE_MARKER, HEADER_SIZE_SW, MAX_ATTEMPTS,
+    RATE)
+from lib.utils.metrics import SessionStats
+from lib.utils.rtt_estimator import RttEstimator
 from lib.utils.segments import StopAndWaitSegment
-from lib.exceptions import MaxSendAttemptsExceeded
+from lib.utils.token_bucket import TokenBucket
+from lib.exceptions import MaxSendAttemptsExceeded, ProtocolStopped
 
 
 class StopAndWait:
-    def __init__(self, socket, address, verbose, quiet):
+    def __init__(self, socket, address, verbose, quiet, rate=RATE):
         self.destination_address = address
 
         self.ack = 0  # ACK 0 o 1
@@ -17,13 +23,29 @@ class StopAndWait:
         self.quiet = quiet
         self.communication_queue = Queue()  # Queue for receiving ACKs
         self.header_size = HEADER_SIZE_SW  # Header size in bytes
-        self.data_size = BUFFER_SIZE - HEADER_SIZE_SW
+        # Tamaño de los datagramas y si llevan CRC, lo fija el INIT de la
+        # sesión
+        self.segment_size = BUFFER_SIZE
+        self.crc = True
+        self.stats = SessionStats()
+        self.rtt = RttEstimator(self.stats)
+        # Un paquete por RTT ya va espaciado, "auto" no agrega pacing
+        self.pacer = TokenBucket(0 if rate == "auto" else rate)
+        self.stats.rate = self.pacer.rate
+
+    def apply_init(self, init_segment):
+        """Take the parameters agreed in the handshake"""
+        self.segment_size = init_segment.segment_size
+        self.crc = init_segment.checksum == CHECKSUM_CRC32
+
+    @property
+    def data_size(self) -> int:
+        """Payload bytes that fit in a segment of the session"""
+        return self.segment_size - self.header_size
 
     def send(self, payload, eof=0):  # Send a single package
-        SW_segment = StopAndWaitSegment(
-            payload=payload, seq_num=self.seq, eof_num=eof)
-
-        serialized_packet = SW_segment.serialize(self.verbose)
+        serialized_packet = self.build_packet(payload, eof)
+        self.pacer.pace(len(serialized_packet))
 
         while MAX_ATTEMPTS > self.send_attempts:
 
@@ -31,53 +53,125 @@ class StopAndWait:
                 print(f"Sending SW packet: {serialized_packet}")
 
             self.socket.sendto(serialized_packet, self.destination_address)
+            sent_at = self.count_sent(serialized_packet)
 
             try:
-                ack_packet = self.communication_queue.get(timeout=TIMEOUT)
-
-                if self.verbose:
-                    print(f"Received ACK for SW. Bytes: {ack_packet}")
-
-                ack_packet = StopAndWaitSegment.deserialize(
-                    ack_packet, self.verbose)
-                if ack_packet.ack_num == self.seq:
-                    # Package received successfully
-                    self.send_attempts = 0
-                    self.seq = 1 - self.seq
-                    return
-                else:
-                    # The ACK is not what I expect
-                    # Debug
-                    if self.verbose:
-                        print(
-                            "[StopAndWaitW] Duplicate or corrupt package:"
-                            f"{ack_packet}")
+                first_attempt = self.send_attempts == 0
+                self.wait_ack(sent_at + self.rtt.rto)
+                if first_attempt:  # Karn: sin muestras de reenvíos
+                    self.add_rtt_sample(time.monotonic() - sent_at)
+                return
 
             except Empty:
                 print("[StopAndWait] Timeout waiting for ACK")  # Debug
+                self.rtt.backoff()
 
             self.send_attempts += 1
 
         # exited the while, the packet could not be sent -> the program closes
-        raise MaxSendAttemptsExceeded(
+        raise self.max_attempts_error()
+
+    def wait_ack(self, deadline):
+        """Wait until deadline for the ACK of the packet in flight,
+        raises Empty on timeout. Stale ACKs (of a copy already confirmed)
+        and corrupt ones are skipped: retransmitting on them would send
+        every packet twice from then on"""
+        while True:
+            ack_packet = self.communication_queue.get(
+                timeout=max(0, deadline - time.monotonic()))
+            if ack_packet is CLOSE_MARKER:
+                raise ProtocolStopped("Session terminated while sending")
+            if self.is_expected_ack(ack_packet):
+                return
+
+    def is_expected_ack(self, ack_packet) -> bool:
+        try:
+            return self.handle_ack(ack_packet)
+        except ValueError:  # CRC, ya contado en stats
+            return False
+
+    def count_sent(self, packet) -> float:
+        """Count a data packet sent, returns when it was sent"""
+        if self.send_attempts == 0:
+            self.stats.sent(len(packet))
+        else:
+            self.stats.retransmitted(len(packet))
+            self.pacer.charge(len(packet))
+        return time.monotonic()
+
+    def add_rtt_sample(self, rtt):
+        self.stats.add_rtt(rtt)
+        self.rtt.sample(rtt)
+
+    def free_window(self):
+        """Stop and Wait is a window of a single packet"""
+        return 1
+
+    def send_many(self, items):
+        """Send (payload, eof) items one after the other"""
+        for payload, eof in items:
+            self.send(payload, eof)
+
+    def all_acked(self):
+        """send only returns once the packet is confirmed"""
+        return True
+
+    def build_packet(self, payload, eof=0):
+        SW_segment = StopAndWaitSegment(
+            payload=payload, seq_num=self.seq, eof_num=eof)
+
+        return SW_segment.serialize(self.verbose, self.crc)
+
+    def handle_ack(self, ack_packet) -> bool:
+        """Check a received ACK, returns True if it confirms the
+        packet in flight (and moves on to the next seq)"""
+        if self.verbose:
+            print(f"Received ACK for SW. Bytes: {ack_packet}")
+
+        ack_packet = self.deserialize(ack_packet)
+        if ack_packet.ack_num == self.seq:
+            # Package received successfully
+            self.send_attempts = 0
+            self.seq = 1 - self.seq
+            return True
+
+        # The ACK is not what I expect
+        # Debug
+        if self.verbose:
+            print(
+                "[StopAndWaitW] Duplicate or corrupt package:"
+                f"{ack_packet}")
+        return False
+
+    def max_attempts_error(self):
+        return MaxSendAttemptsExceeded(
             f"The packet with seq {self.seq} could not be sent"
             f" after {MAX_ATTEMPTS} attempts."
         )
 
-    def put_bytes(self, data):
-        """Put an ACK packet into the queue"""
+    def deserialize(self, data) -> StopAndWaitSegment:
+        try:
+            return StopAndWaitSegment.deserialize(data, self.verbose,
+                                                  self.crc)
+        except ValueError:
+            self.stats.crc_failures += 1
+            raise
+
+    def put_bytes(self, data) -> bool:
+        """Put a packet into the queue, always queued"""
+        self.stats.received(len(data))
         if self.verbose:
             print(f"[StopAndWait] Putting {len(data)} bytes "
                   f"into communication queue")
-        self.communication_queue.put(data)
+        self.communication_queue.put_nowait(data)
+        return True
 
     def unpack(self, serialized_data: bytes) -> tuple[bool, StopAndWaitSegment,
                                                       bytes]:
         """
         Receive SW package and deserializes, return bytes for ack
         """
-        deserialized_data = StopAndWaitSegment.deserialize(
-            serialized_data, self.verbose)
+        deserialized_data = self.deserialize(serialized_data)
 
         if deserialized_data.seq_num == self.ack:
             # Expected packet
@@ -96,22 +190,31 @@ class StopAndWait:
                       f"package: {deserialized_data}")
             new_ack_num = 1 - self.ack
             is_repeated = True
+            self.stats.duplicates += 1
             # send the last ACK I received
             ack_packet = StopAndWaitSegment(ack_num=new_ack_num)
 
-        ack_bytes = ack_packet.serialize(self.verbose)
+        ack_bytes = ack_packet.serialize(self.verbose, self.crc)
 
         return (is_repeated, deserialized_data, ack_bytes)
 
-    def receive_file(self, data_bytes) -> tuple[bytes, bool, bool]:
+    def receive_file(self, data_bytes) -> tuple[list, bool, bool]:
         """
         Receives SW data bytes and responds to the message,
-        returns a tuple of bool:
-            - 0: Indicates if the payload is repeated
-            - 1: Indicates if the received datagram indicates EOF
+        returns a tuple:
+            - 0: The run of (payload, datagram) now in order, this one
+                 unless it is repeated (then the datagram is released)
+            - 1: Indicates if the payload is repeated
+            - 2: Indicates if the received datagram indicates EOF
         """
 
-        (is_repeated, data, ack_bytes) = self.unpack(data_bytes)
+        try:
+            (is_repeated, data, ack_bytes) = self.unpack(data_bytes)
+        except ValueError as e:
+            # Roto o cortado: sin ACK, el emisor lo reenvía
+            print(f"[StopAndWait] Error: {e}")
+            release_buffer(data_bytes)
+            return ([], False, False)
         is_eof = False
 
         try:
@@ -127,8 +230,16 @@ class StopAndWait:
                       f"to: {self.destination_address}")
 
             self.socket.sendto(ack_bytes, self.destination_address)
+            self.stats.sent(len(ack_bytes))
 
         except Exception as e:
             print(f"[StopAndWait] Error receiving: {e}")  # Debug
 
-        return (data.payload, is_repeated, is_eof)
+        if is_repeated:
+            release_buffer(data_bytes)
+            return ([], True, is_eof)
+        return ([(data.payload, data_bytes)], False, is_eof)
+
+    def stop(self):
+        """Nothing runs in background, kept to match SelectiveRepeat"""
+        pass
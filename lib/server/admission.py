@@ -0,0 +1,115 @@
+import asyncio
+import queue
+import threading
+
+from lib.utils.buffer_pool import release_buffer
+from lib.utils.constants import CLOSE_MARKER
+
+
+class InboundBudget:
+    """Datagrams waiting in the inboxes of every session of a server, at
+    most limit. Datagrams over the budget are dropped and the client
+    retransmits them, instead of queueing without bound"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def full(self) -> bool:
+        return self.count >= self.limit
+
+    def take(self) -> bool:
+        with self.lock:
+            if self.count >= self.limit:
+                self.dropped += 1
+                return False
+            self.count += 1
+            return True
+
+    def give(self):
+        with self.lock:
+            self.count -= 1
+
+
+class BudgetQueue(queue.Queue):
+    """Session inbox counted against an InboundBudget, put raises
+    queue.Full once the budget is spent. CLOSE_MARKER always fits.
+
+    Once the session stops reading it (close) the inbox gives its budget
+    back and drops whatever arrives later, like the late ACKs of a
+    finished download"""
+
+    def __init__(self, budget):
+        super().__init__()
+        self.budget = budget
+        self.closed = False
+
+    def put(self, item, block=True, timeout=None):
+        if item is not CLOSE_MARKER and not self.budget.take():
+            raise queue.Full
+        super().put(item, block, timeout)
+
+    def _put(self, item):
+        if self.closed and item is not CLOSE_MARKER:
+            self.budget.give()
+            release_buffer(item)
+            return
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if item is not CLOSE_MARKER:
+            self.budget.give()
+        return item
+
+    def close(self):
+        with self.mutex:
+            self.closed = True
+            drop_queued(self.queue, self.budget)
+
+
+class AsyncBudgetQueue(asyncio.Queue):
+    """BudgetQueue for the asyncio engine, raises asyncio.QueueFull"""
+
+    def __init__(self, budget):
+        super().__init__()
+        self.budget = budget
+        self.closed = False
+
+    def put_nowait(self, item):
+        if item is not CLOSE_MARKER and not self.budget.take():
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+
+    def _put(self, item):
+        if self.closed and item is not CLOSE_MARKER:
+            self.budget.give()
+            release_buffer(item)
+            return
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if item is not CLOSE_MARKER:
+            self.budget.give()
+        return item
+
+    def close(self):
+        self.closed = True
+        drop_queued(self._queue, self.budget)
+
+
+def drop_queued(items, budget):
+    """Drop the datagrams of a closed inbox (a deque), giving back their
+    budget. A CLOSE_MARKER stays for a worker that is still waiting"""
+    markers = 0
+    while items:
+        item = items.popleft()
+        if item is CLOSE_MARKER:
+            markers += 1
+            continue
+        budget.give()
+        release_buffer(item)
+    items.extend([CLOSE_MARKER] * markers)
@@ -0,0 +1,123 @@
+import asyncio
+import sys
+
+from lib.exceptions import ServerBusy
+from lib.utils.constants import SWEEP_INTERVAL
+from lib.utils.metrics import registry
+from ..utils.segments import InitSegment, ProbeSegment
+from ..utils.async_connection_info import AsyncConnectionInfo
+from .admission import InboundBudget
+from .metrics_exporter import start_exporters, stop_exporters
+from .server_manager import (
+    create_server_socket, error_reply, negotiate, print_config,
+    resend_init_ack, send_busy, send_init_ack, send_probe_ack)
+from .session_manager import SessionManager
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    """asyncio engine: one event loop drives every session, datagrams are
+    dispatched from datagram_received in arrival order"""
+
+    def __init__(self, args):
+        self.args = args
+        self.transport = None
+        self.sessions = SessionManager(args.idle_timeout, args.max_sessions,
+                                       args.verbose, args.max_transfers,
+                                       InboundBudget(args.max_queue))
+        self.flag = 1
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, client_address):
+        args = self.args
+        if not args.quiet:
+            print(f"\n[SERVER]-[MSG N°{self.flag}] Received data from client: "
+                  f"{client_address}\n")
+        self.flag += 1
+
+        init_segment = None
+        try:
+            if data == b"FIN":
+                print(f"[SERVER] Received FIN message from {client_address}")
+                self.sessions.remove(client_address)
+                return
+
+            connectionInfo = self.sessions.get(client_address)
+            if connectionInfo is None and ProbeSegment.is_probe(data):
+                send_probe_ack(self.transport, data, client_address, args)
+                return
+            if connectionInfo is None:
+                print("[SERVER] Starting new connection "
+                      f"with {client_address}")
+                init_message = bytes(data)
+                init_segment = InitSegment.deserialize(data, args.verbose)
+                negotiate(init_segment, args)
+                self.sessions.admit()
+
+                connectionInfo = AsyncConnectionInfo(
+                    init_segment, client_address, self.transport, args,
+                    self.sessions.inbound, init_message)
+                try:
+                    self.sessions.add(client_address, connectionInfo)
+                except ServerBusy:
+                    connectionInfo.terminate()
+                    raise
+
+                send_init_ack(self.transport, init_segment,
+                              client_address, args)
+                connectionInfo.start()
+            elif connectionInfo.is_init(data):
+                resend_init_ack(self.transport, connectionInfo,
+                                client_address, args)
+            else:
+                if args.verbose:
+                    print(f"[SERVER] Is existing client: {client_address}")
+                connectionInfo.dispatch(data)
+
+        except ServerBusy as e:
+            print(f"[SERVER] Busy, asking {client_address} to retry: {e}")
+            registry.count("sessions_rejected")
+            send_busy(self.transport, init_segment, client_address, args)
+        except Exception as e:
+            if args.verbose:
+                print("[SERVER] Error processing message "
+                      f"from {client_address}: {e}")
+            self.transport.sendto(error_reply(e), client_address)
+
+    def error_received(self, exc):
+        if self.args.verbose:
+            print(f"[SERVER] Socket error: {exc}")
+
+    def close_connections(self):
+        self.sessions.close_all()
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: ServerProtocol(args), sock=create_server_socket(args))
+    print(f"\nServer started. Listening on {args.host}:{args.port}"
+          " (asyncio engine)")
+    exporters = start_exporters(args)
+
+    try:
+        while True:  # Hasta que se interrumpa
+            await asyncio.sleep(SWEEP_INTERVAL)
+            protocol.sessions.evict_idle()
+    finally:
+        protocol.close_connections()
+        stop_exporters(exporters)
+        transport.close()
+
+
+def run(args):
+    print_config(args)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\nServer shutting down gracefully\n")
+    except Exception as e:
+        print(f"Server error: {e}", file=sys.stderr)
+        raise e
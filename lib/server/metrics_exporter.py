@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lib.utils.metrics import registry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics as text lines, GET /metrics.json as JSON"""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = registry.render_text().encode()
+            content_type = "text/plain; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(registry.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin un print por cada scrape
+
+
+class MetricsHttpServer:
+    """Local HTTP endpoint, served from a daemon thread"""
+
+    def __init__(self, port):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsDumper:
+    """Writes a JSON snapshot to path every interval seconds (and once
+    more on close). The file is replaced atomically, readers never see
+    it half written"""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as tmp_file:
+                json.dump(registry.snapshot(), tmp_file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[SERVER] Could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=1)
+        self.dump()
+
+
+def start_exporters(args) -> list:
+    """Start what --metrics-port / --metrics-file ask for. With --workers
+    each worker serves metrics-port + its index and writes
+    metrics-file.<index>"""
+    worker_id = getattr(args, "worker_id", None)
+    exporters = []
+    if args.metrics_port:
+        port = args.metrics_port + (worker_id or 0)
+        exporters.append(MetricsHttpServer(port))
+        print(f"Metrics on http://127.0.0.1:{port}/metrics")
+    if args.metrics_file:
+        path = args.metrics_file
+        if worker_id is not None:
+            path = f"{path}.{worker_id}"
+        exporters.append(MetricsDumper(path, args.metrics_interval))
+    return exporters
+
+
+def stop_exporters(exporters):
+    for exporter in exporters:
+        exporter.close()
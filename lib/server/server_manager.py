@@ -1,18 +1,40 @@
+import argparse
+import multiprocessing
+import os
+import signal
 import socket
 import sys
-import threading
-from typing import Dict, Tuple
+from typing import Tuple
 
-from lib.utils.constants import BUFFER_SIZE, DOWNLOAD_OPERATION
-from ..utils.segments import InitSegment
+from lib.exceptions import ServerBusy
+from lib.utils.constants import (
+    BUFFER_SIZE, CHECKSUM_CRC32, COMPRESSION_NONE, DOWNLOAD_OPERATION,
+    MIN_SEGMENT_SIZE, RETRY_AFTER, SWEEP_INTERVAL)
+from lib.utils.metrics import registry
+from lib.utils.static import CHECKSUMS, COMPRESSIONS
+from ..utils.batch_io import BatchReceiver
+from ..utils.buffer_pool import BufferPool, release_buffer
+from ..utils.shared_socket import SharedSocket
+from ..utils.segments import InitSegment, ProbeSegment
 from ..utils.connection_info import ConnectionInfo
+from .admission import InboundBudget
+from .metrics_exporter import start_exporters, stop_exporters
+from .session_manager import SessionManager
 
 
 def process_message(data: bytes, client_address: Tuple[str, int],
-                    server_socket: socket.socket,
-                    client_connections: Dict[Tuple[str, int], ConnectionInfo],
+                    server_socket: SharedSocket,
+                    sessions: SessionManager,
                     args):
-    """Handle received message in a separate thread"""
+    """Dispatch a received message to the session of its client.
+
+    Runs on the receiving thread, so datagrams from the same client are
+    handed to its session in arrival order. Anything that can block is done
+    by the session worker started in ConnectionInfo.start.
+
+    data may be a pooled buffer: it is released here unless it is handed
+    to a session, which then owns it"""
+    init_segment = None
     try:
         if not args.quiet:
             print(f"[SERVER] Processing {len(data)} bytes of data "
@@ -21,77 +43,173 @@ def process_message(data: bytes, client_address: Tuple[str, int],
         # Check if this is a FIN message
         if data == b"FIN":
             print(f"[SERVER] Received FIN message from {client_address}")
+            release_buffer(data)
             # Remove client from connections
-            with client_connections_lock:
-                if client_address in client_connections:
-                    client_connections[
-                        client_address].terminate()
-                    del client_connections[client_address]
+            sessions.remove(client_address)
             return
 
         # Check if this is a new client (INIT message)
-        if client_address not in client_connections:
-            with client_connections_lock:
-                print("[SERVER] Starting new connection "
+        connectionInfo = sessions.get(client_address)
+        if connectionInfo is None and ProbeSegment.is_probe(data):
+            try:
+                send_probe_ack(server_socket, data, client_address, args)
+            finally:
+                release_buffer(data)
+            return
+        if connectionInfo is None:
+            print("[SERVER] Starting new connection "
+                  f"with {client_address}")
+            init_message = bytes(data)
+            init_segment = InitSegment.deserialize(data, args.verbose)
+            release_buffer(data)
+            negotiate(init_segment, args)
+
+            if args.verbose:
+                print("[SERVER] Successfully deserialized init segment "
+                      f"from {client_address}")
+
+            # Rechaza antes de abrir archivo, socket o hilos
+            sessions.admit()
+
+            session_socket = server_socket if args.shared_socket else None
+            connectionInfo = ConnectionInfo(init_segment, client_address,
+                                            args, session_socket,
+                                            sessions.inbound, init_message)
+            try:
+                sessions.add(client_address, connectionInfo)
+            except ServerBusy:
+                connectionInfo.terminate()
+                raise
+
+            send_init_ack(server_socket, init_segment, client_address, args)
+
+            # The session worker drives the transfer from now on
+            connectionInfo.start()
+        elif connectionInfo.is_init(data):
+            release_buffer(data)
+            resend_init_ack(server_socket, connectionInfo, client_address,
+                            args)
+        else:
+            if args.verbose:
+                print(f"[SERVER] Is existing client: {client_address}")
+            if connectionInfo.finished and not args.quiet:
+                print("[SERVER] Already finished transfer "
                       f"with {client_address}")
-                init_segment = InitSegment.deserialize(data, args.verbose)
-                client_opcode = init_segment.opcode
+            # Even a finished session may still need ACKs (SR retransmits)
+            connectionInfo.dispatch(data)
 
-                if args.verbose:
-                    print("[SERVER] Successfully deserialized init segment "
-                          f"from {client_address}")
+    except ServerBusy as e:
+        release_buffer(data)
+        print(f"[SERVER] Busy, asking {client_address} to retry: {e}")
+        registry.count("sessions_rejected")
+        send_busy(server_socket, init_segment, client_address, args)
+    except Exception as e:
+        release_buffer(data)
+        if args.verbose:
+            print("[SERVER] Error processing message "
+                  f"from {client_address}: {e}")
+        server_socket.sendto(error_reply(e), client_address)
 
-                connectionInfo = ConnectionInfo(init_segment,
-                                                client_address, args)
-                connectionInfo.lock = threading.Lock()
-                client_connections[client_address] = connectionInfo
 
-                init_ack = InitSegment(client_opcode,
-                                       init_segment.protocol, 0b1, "")
+def error_reply(error) -> bytes:
+    """ERROR reply for a message that could not be handled. It carries
+    the reason, so it never matches the LEGACY_ERROR of servers older
+    than the extended INIT, the only reply a client falls back on"""
+    reason = str(error)
+    if isinstance(error, OSError) and error.strerror:
+        reason = error.strerror  # Sin la ruta del archivo en el servidor
+    return f"ERROR: {reason or type(error).__name__}".encode()
 
-                init_ack_bytes = init_ack.serialize(args.verbose)
 
-                if not args.quiet:
-                    print("[SERVER] Sending connection confirmation "
-                          f"with {client_address}")
+def resend_init_ack(sender, connectionInfo, client_address, args):
+    """The client retransmitted its INIT, so the INIT_ACK was lost. The
+    session is already running: answer again, do not open another one"""
+    if not args.quiet:
+        print(f"[SERVER] Repeated INIT from {client_address}, "
+              "resending INIT_ACK")
+    registry.count("init_retransmits")
+    send_init_ack(sender, connectionInfo.init_segment, client_address, args)
 
-                if args.verbose:
-                    print(f"[SERVER] Sending INIT_ACK bytes: {init_ack_bytes}")
-                # Send INIT_ACK for successful INIT
-                server_socket.sendto(init_ack_bytes, client_address)
 
-                needs_initial_upload = client_opcode == DOWNLOAD_OPERATION
+def send_init_ack(sender, init_segment: InitSegment,
+                  client_address: Tuple[str, int], args):
+    """Confirm an INIT, sender is the server socket or an asyncio
+    transport (anything with sendto)"""
+    init_ack = InitSegment.ack_reply(init_segment)
 
-                # Needed initiation for server upload operation
-            with client_connections[client_address].lock:
-                if needs_initial_upload:
-                    connectionInfo.operation_handler.transfer(is_client=False)
-        else:
-            connectionInfo = client_connections[client_address]
-            connectionInfo.operation_handler.protocol_handler.put_bytes(data)
+    init_ack_bytes = init_ack.serialize(args.verbose)
 
-            with connectionInfo.lock:
-                if args.verbose:
-                    print(f"[SERVER] Is existing client: {client_address}")
-                if connectionInfo.finished:
-                    print("[SERVER] Already finished transfer "
-                          f"with {client_address}")
-                    return
+    if not args.quiet:
+        print("[SERVER] Sending connection confirmation "
+              f"with {client_address}")
 
-                finished = connectionInfo.operation_handler.transfer(
-                    is_client=False)
-                connectionInfo.set_finished(finished)
+    if args.verbose:
+        print(f"[SERVER] Sending INIT_ACK bytes: {init_ack_bytes}")
+    # Send INIT_ACK for successful INIT
+    sender.sendto(init_ack_bytes, client_address)
 
-    except Exception as e:
-        if args.verbose:
-            print("[SERVER] Error processing message "
-                  f"from {client_address}: {e}")
-        server_socket.sendto(
-            "ERROR: Internal server error".encode(),
-            client_address)
 
+def negotiate(init_segment: InitSegment, args):
+    """Settle the parameters of a new session from what the client asked
+    for, init_segment keeps them and the INIT_ACK carries them back.
+    Options this server does not know fall back to their defaults"""
+    # Un cliente que no pide tamaño en el formato original (los anteriores
+    # al tamaño negociado) no entiende un INIT_ACK que lo lleve: usa
+    # BUFFER_SIZE aunque el --segment-size del servidor sea menor
+    if init_segment.version or init_segment.sized:
+        init_segment.segment_size = max(
+            MIN_SEGMENT_SIZE,
+            min(init_segment.segment_size, args.segment_size))
+    init_segment.initial_window = min(
+        init_segment.initial_window or args.initial_window,
+        args.max_inflight)
+    if init_segment.compression not in COMPRESSIONS.values():
+        init_segment.compression = COMPRESSION_NONE
+    if init_segment.checksum not in CHECKSUMS.values():
+        init_segment.checksum = CHECKSUM_CRC32
 
-def run(args):
+    path = args.storage + '/' + init_segment.name.decode("utf-8")
+    size = os.path.getsize(path) if os.path.isfile(path) else None
+    offset = init_segment.resume_offset
+    if init_segment.opcode == DOWNLOAD_OPERATION:
+        init_segment.file_size = size
+        if offset is not None and (size is None or offset > size):
+            offset = 0  # El archivo cambió, se baja entero
+    elif offset is not None:
+        # Lo que quedó de una subida anterior, si no es más largo que el
+        # archivo que se sube
+        offset = size or 0
+        if (init_segment.file_size is not None
+                and offset > init_segment.file_size):
+            offset = 0
+    init_segment.resume_offset = offset
+
+    if args.verbose:
+        print(f"[SERVER] Segment size: {init_segment.segment_size}, "
+              f"initial window: {init_segment.initial_window}, "
+              f"resume offset: {init_segment.resume_offset}")
+
+
+def send_probe_ack(sender, data, client_address: Tuple[str, int], args):
+    """Echo a PMTU probe that arrived whole, no session is opened. A
+    probe cut by the receive buffer fails its CRC, for the client it did
+    not fit"""
+    probe = ProbeSegment.deserialize(data)
+    if args.verbose:
+        print(f"[SERVER] PMTU probe of {probe.size} bytes "
+              f"from {client_address}")
+    sender.sendto(ProbeSegment(probe.size, 0b1).serialize(), client_address)
+
+
+def send_busy(sender, init_segment: InitSegment,
+              client_address: Tuple[str, int], args):
+    """Answer an INIT that cannot be admitted now with a busy reply,
+    the client retries after RETRY_AFTER seconds"""
+    busy_reply = InitSegment.busy_reply(init_segment, RETRY_AFTER)
+    sender.sendto(busy_reply.serialize(args.verbose), client_address)
+
+
+def print_config(args):
     if args.verbose:
         print("=== Server Config ===")
         print(f"Verbose      : {args.verbose}")
@@ -100,45 +218,118 @@ def run(args):
         print(f"Port         : {args.port}")
         print(f"Storage Path : {args.storage}")
         print(f"Protocol     : {args.protocol}")
+        print(f"Engine       : {args.engine}")
+        print(f"Workers      : {args.workers}")
+        print(f"Shared socket: {args.shared_socket}")
+        print(f"Idle timeout : {args.idle_timeout}")
+        print(f"Max sessions : {args.max_sessions}")
+        print(f"Max transfers: {args.max_transfers}")
+        print(f"Max inflight : {args.max_inflight}")
+        print(f"Congestion   : {args.congestion}")
+        print(f"ACK every    : {args.ack_every}")
+        print(f"ACK delay    : {args.ack_delay}")
+        print(f"Rate         : {args.rate}")
+        print(f"FEC block    : {args.fec_block}")
+        print(f"FEC parity   : {args.fec_parity}")
+        print(f"Segment size : {args.segment_size}")
+        print(f"Init window  : {args.initial_window}")
+        print(f"Max queue    : {args.max_queue}")
+        print(f"Metrics port : {args.metrics_port}")
+        print(f"Metrics file : {args.metrics_file}")
 
-    # Create UDP socket
+
+def create_server_socket(args) -> socket.socket:
+    """Create and bind the listening socket. With more than one worker
+    every process binds the same address with SO_REUSEPORT"""
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if args.workers > 1:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((args.host, args.port))
+    return server_socket
+
 
-    # Dictionary to store client connections
-    client_connections: Dict[Tuple[str, int], ConnectionInfo] = {}
-    global client_connections_lock
-    client_connections_lock = threading.Lock()
+def run_workers(args, target):
+    """Fork args.workers processes running target(args) on the same
+    (host, port). The kernel hashes each client address to one worker, so
+    client_connections never has to be shared between processes"""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("SO_REUSEPORT is not available, running a single worker",
+              file=sys.stderr)
+        args.workers = 1
+        return target(args)
 
-    server_socket.settimeout(5.0)  # 5 segundos
+    print(f"Starting {args.workers} workers on {args.host}:{args.port}")
+    workers = [
+        # worker_id: cada worker exporta sus propias métricas
+        multiprocessing.Process(
+            target=target, name=f"worker-{i}",
+            args=(argparse.Namespace(**vars(args), worker_id=i),))
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Los workers reciben el SIGINT de la terminal, pero no si solo
+        # se interrumpe a este proceso
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def run(args):
+    print_config(args)
+
+    # Create UDP socket
+    listen_socket = create_server_socket(args)
+    # Despierta cada SWEEP_INTERVAL para desalojar sesiones inactivas
+    listen_socket.settimeout(SWEEP_INTERVAL)
+
+    # Every send of the server (and of the sessions, in shared socket
+    # mode) goes through this thread-safe path
+    server_socket = SharedSocket(listen_socket)
+
+    # Client sessions, only touched by this thread
+    sessions = SessionManager(args.idle_timeout, args.max_sessions,
+                              args.verbose, args.max_transfers,
+                              InboundBudget(args.max_queue))
+    exporters = start_exporters(args)
 
     try:
-        # Bind socket to address
-        server_socket.bind((args.host, args.port))
         print(f"\nServer started. Listening on {args.host}:{args.port}")
 
+        # Buffers del tamaño más grande que se usa: el negociado o el de
+        # siempre de los clientes que no lo piden
+        size = max(args.segment_size, BUFFER_SIZE)
+        receiver = BatchReceiver(bufsize=size, pool=BufferPool(size=size))
         flag = 1
         while True:
+            sessions.maybe_evict_idle()
             try:
-                # Receive data
-                data, client_address = server_socket.recvfrom(BUFFER_SIZE)
+                # Receive every datagram already queued, one syscall
+                datagrams = receiver.recv_batch(listen_socket)
             except socket.timeout:
                 if not args.quiet:
                     print("[SERVER] Waiting for any client message...")
                 continue
 
-            if not args.quiet:
-                print(f"\n[SERVER]-[MSG N°{flag}] Received data from client: "
-                      f"{client_address}\n")
-            flag += 1
+            for data, client_address in datagrams:
+                if not args.quiet:
+                    print(f"\n[SERVER]-[MSG N°{flag}] Received data from "
+                          f"client: {client_address}\n")
+                flag += 1
 
-            # Create and start a new thread for message processing
-            thread = threading.Thread(
-                target=process_message,
-                args=(data, client_address, server_socket,
-                      client_connections, args)
-            )
-            thread.daemon = True
-            thread.start()
+                # Dispatch in place: no thread per datagram, the per-session
+                # worker does the blocking part of the transfer
+                process_message(data, client_address, server_socket,
+                                sessions, args)
 
     except KeyboardInterrupt:
         print("\nServer shutting down gracefully\n")
@@ -147,4 +338,8 @@ def run(args):
         raise e
 
     finally:
-        server_socket.close()
+        for session in sessions.close_all():
+            # Su reaper cierra el archivo, esperarlo antes de salir
+            session.reaper.join()
+        stop_exporters(exporters)
+        listen_socket.close()
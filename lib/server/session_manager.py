@@ -0,0 +1,120 @@
+import time
+
+from lib.exceptions import ServerBusy, SessionLimitReached
+from lib.utils.constants import MAX_TRANSFERS, SWEEP_INTERVAL
+from lib.utils.metrics import registry
+
+
+class SessionManager:
+    """Table of client sessions (ConnectionInfo or AsyncConnectionInfo)
+    with the last activity of each one. Sessions idle for longer than
+    idle_timeout are evicted and at most max_sessions are kept.
+
+    admit decides whether a new transfer can start: at most max_transfers
+    unfinished sessions, and only while the inbound budget (InboundBudget
+    shared by the session inboxes) has room"""
+
+    def __init__(self, idle_timeout, max_sessions, verbose=False,
+                 max_transfers=MAX_TRANSFERS, inbound=None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_transfers = max_transfers
+        self.inbound = inbound
+        self.verbose = verbose
+        self.sessions = {}
+        self.last_activity = {}
+        self.last_sweep = time.monotonic()
+
+        registry.add_gauge("active_sessions", self.__len__)
+        registry.add_gauge("active_transfers", self.active_transfers)
+        if inbound is not None:
+            registry.add_gauge("inbound_queued", lambda: inbound.count)
+            registry.add_gauge("inbound_dropped", lambda: inbound.dropped)
+
+    def __contains__(self, client_address):
+        return client_address in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, client_address):
+        """Session of client_address (None if there is none), counts as
+        activity of that client"""
+        session = self.sessions.get(client_address)
+        if session is not None:
+            self.last_activity[client_address] = time.monotonic()
+        return session
+
+    def active_transfers(self) -> int:
+        # list(): también la lee el hilo de las métricas
+        return sum(1 for session in list(self.sessions.values())
+                   if not session.finished)
+
+    def admit(self):
+        """Raise ServerBusy (or SessionLimitReached) if a new transfer
+        cannot start now, before anything is allocated for it"""
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+        if len(self.sessions) >= self.max_sessions:
+            raise SessionLimitReached(
+                f"Session limit reached ({self.max_sessions})")
+        if self.active_transfers() >= self.max_transfers:
+            raise ServerBusy(
+                f"Transfer limit reached ({self.max_transfers})")
+        if self.inbound is not None and self.inbound.full():
+            raise ServerBusy(f"Inbound queue full ({self.inbound.limit})")
+
+    def add(self, client_address, session):
+        """Register a new session, raises SessionLimitReached when the
+        table is full even after evicting the idle ones"""
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+        if len(self.sessions) >= self.max_sessions:
+            raise SessionLimitReached(
+                f"Session limit reached ({self.max_sessions})")
+
+        self.sessions[client_address] = session
+        self.last_activity[client_address] = time.monotonic()
+        registry.register(_label(client_address),
+                          session.protocol_handler.stats)
+        registry.count("sessions_started")
+
+    def remove(self, client_address):
+        """Terminate and forget the session, returns it (or None)"""
+        session = self.sessions.pop(client_address, None)
+        self.last_activity.pop(client_address, None)
+        if session is not None:
+            session.terminate()
+            registry.unregister(_label(client_address))
+        return session
+
+    def evict_idle(self):
+        """Terminate every session idle for longer than idle_timeout,
+        returns the evicted addresses"""
+        now = time.monotonic()
+        self.last_sweep = now
+        idle = [
+            client_address
+            for client_address, last in self.last_activity.items()
+            if now - last > self.idle_timeout
+        ]
+        for client_address in idle:
+            print(f"[SERVER] Evicting idle session with {client_address}")
+            self.remove(client_address)
+            registry.count("sessions_evicted")
+        return idle
+
+    def maybe_evict_idle(self):
+        """evict_idle, at most once every SWEEP_INTERVAL seconds"""
+        if time.monotonic() - self.last_sweep >= SWEEP_INTERVAL:
+            return self.evict_idle()
+        return []
+
+    def close_all(self) -> list:
+        """Terminate every session, returns them"""
+        return [self.remove(client_address)
+                for client_address in list(self.sessions)]
+
+
+def _label(client_address):
+    return f"{client_address[0]}:{client_address[1]}"
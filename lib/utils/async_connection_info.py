@@ -0,0 +1,184 @@
+import asyncio
+import errno
+import os
+import zlib
+
+from lib.server.admission import AsyncBudgetQueue
+from lib.utils.compression import ChunkCompressor
+from lib.utils.constants import (
+    APPEND_MODE, COMPRESSION_ZLIB, DOWNLOAD_OPERATION, READ_MODE,
+    STOP_AND_WAIT)
+from lib.utils.file_manager import FileManager
+from lib.utils.segments import InitSegment
+from lib.utils.static import (
+    get_async_protocol_from_code,
+    get_protocol_name_from_protocol_code)
+
+
+class AsyncConnectionInfo:
+    """Session of the asyncio engine, the counterpart of ConnectionInfo.
+    The transfer runs as a task of the event loop and every session sends
+    through the listening transport, so an idle session costs no thread"""
+
+    def __init__(self, init_segment: 'InitSegment', client_address,
+                 transport, args, inbound=None, init_message=b""):
+        self.client_address = client_address
+        self.opcode = init_segment.opcode
+        self.protocol = get_protocol_name_from_protocol_code(
+            init_segment.protocol)
+        self.file_path = init_segment.name.decode("utf-8")
+        self.verbose = args.verbose
+        self.quiet = args.quiet
+        self.finished = False
+        self.task = None
+
+        server_path = args.storage + '/' + self.file_path
+
+        if self.opcode == DOWNLOAD_OPERATION:
+            if not os.path.exists(server_path):
+                print(f"ERROR: Source file not found: {server_path}")
+                raise FileNotFoundError(
+                    errno.ENOENT, os.strerror(errno.ENOENT), server_path)
+            self.file_manager = FileManager(server_path, READ_MODE)
+        else:
+            self.file_manager = FileManager(server_path, APPEND_MODE)
+        self.file_manager.open()
+
+        self.protocol_handler = get_async_protocol_from_code(
+            init_segment.protocol, transport, client_address,
+            args.verbose, args.quiet, args.max_inflight, args.congestion,
+            args.ack_every, args.ack_delay, args.rate, args.fec_block,
+            args.fec_parity)
+        if init_segment.protocol != STOP_AND_WAIT:
+            # --max-inflight también vale para lo que sube el cliente
+            self.protocol_handler.recv_limit = args.max_inflight
+        self.apply_init(init_segment)
+        self.init_segment = init_segment
+        self.init_message = init_message
+        self.inbox = None
+        if inbound is not None:
+            self.inbox = AsyncBudgetQueue(inbound)
+            self.protocol_handler.communication_queue = self.inbox
+
+    def apply_init(self, init_segment):
+        """Take the parameters agreed in the handshake, like the Uploader
+        and Downloader of the thread engine"""
+        self.protocol_handler.apply_init(init_segment)
+        self.compression = init_segment.compression
+        self.decompressor = None
+        if self.compression == COMPRESSION_ZLIB:
+            self.decompressor = zlib.decompressobj()
+        offset = init_segment.resume_offset
+        if self.opcode == DOWNLOAD_OPERATION:
+            if offset:
+                self.file_manager.seek(offset)
+            return
+        if offset is not None:
+            self.file_manager.truncate(offset)
+        if init_segment.file_size is not None:
+            self.file_manager.preallocate(
+                init_segment.file_size - (offset or 0))
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        try:
+            if self.opcode == DOWNLOAD_OPERATION:
+                await self.send_file()
+            else:
+                await self.receive_file()
+                self.finished = True
+                await self.linger()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.verbose:
+                print(f"[SERVER] Session with {self.client_address} "
+                      f"failed: {e}")
+        finally:
+            self.finished = True
+            # Nadie más lee el inbox, lo que llegue no ocupa el budget
+            self.close_inbox()
+
+    async def send_file(self):
+        """Server side of a download, read the file and send it"""
+        data_size = self.protocol_handler.data_size
+        compressor = None
+        if self.compression == COMPRESSION_ZLIB:
+            compressor = ChunkCompressor(data_size)
+        while True:
+            data = self.file_manager.read(data_size)
+            if not data:
+                for chunk in compressor.flush() if compressor else []:
+                    await self.protocol_handler.send_async(chunk, eof=0)
+                await self.protocol_handler.send_async(b"", eof=1)
+                if not self.quiet:
+                    print(f"[SERVER] Sent {self.file_path} "
+                          f"to {self.client_address}")
+                return
+            if compressor is None:
+                await self.protocol_handler.send_async(data, eof=0)
+                continue
+            for chunk in compressor.chunks(data):
+                await self.protocol_handler.send_async(chunk, eof=0)
+
+    async def receive_file(self):
+        """Server side of an upload, receive the file and write it"""
+        while True:
+            data_bytes = await self.protocol_handler.communication_queue.get()
+            run, _, is_eof = self.protocol_handler.receive_file(data_bytes)
+
+            if run:
+                payloads = [payload for payload, _ in run]
+                if self.decompressor is not None:
+                    payloads = list(map(self.decompressor.decompress,
+                                        payloads))
+                self.file_manager.append_many(payloads)
+                # Con --rate se recibe a ese ritmo: la cola crece y el
+                # emisor se frena (ventana anunciada en SR, ACK más tarde
+                # en SW). Los duplicados no cuentan
+                wait = self.protocol_handler.pacer.delay(
+                    sum(map(len, payloads)))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+            if is_eof:
+                if not self.quiet:
+                    print(f"[SERVER] Received {self.file_path} "
+                          f"from {self.client_address}")
+                self.file_manager.close()
+                return
+
+    async def linger(self):
+        """After the EOF keep answering until FIN or eviction: if our last
+        ACK was lost the client retransmits the EOF and waits for it"""
+        while True:
+            data_bytes = await self.protocol_handler.communication_queue.get()
+            self.protocol_handler.receive_file(data_bytes)
+
+    def is_init(self, data) -> bool:
+        """Whether data is the INIT of this session again: the client did
+        not get the INIT_ACK"""
+        return len(data) == len(self.init_message) \
+            and data == self.init_message
+
+    def dispatch(self, data):
+        try:
+            self.protocol_handler.put_bytes(data)
+        except asyncio.QueueFull:
+            # Sin lugar en el budget global, el cliente retransmite
+            if self.verbose:
+                print(f"[SERVER] Inbound queue full, dropping datagram "
+                      f"for {self.file_path}")
+
+    def terminate(self):
+        self.protocol_handler.stop()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.close_inbox()
+        self.file_manager.close()
+
+    def close_inbox(self):
+        if self.inbox is not None:
+            self.inbox.close()
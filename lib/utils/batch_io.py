@@ -0,0 +1,244 @@
+"""Batched datagram I/O: recvmmsg/sendmmsg through ctypes on Linux and a
+plain recvfrom/sendto loop everywhere else"""
+import ctypes
+import errno
+import functools
+import os
+import select
+import socket
+import struct
+import sys
+
+from lib.utils.constants import BATCH_SIZE, BUFFER_SIZE, MAX_SESSIONS
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+
+SOCKADDR_IN_SIZE = 16  # family (2), port (2), IPv4 (4), padding (8)
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IoVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "recvmmsg") or not hasattr(libc, "sendmmsg"):
+        return None
+
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.recvmmsg.restype = ctypes.c_int
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int]
+    libc.sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+_libc = _load_libc()
+
+# True when recvmmsg/sendmmsg are used, False for the portable fallback
+HAS_MMSG = _libc is not None
+
+
+@functools.lru_cache(maxsize=MAX_SESSIONS)
+def _encode_address(address) -> bytes:
+    """Packed sockaddr_in of address, resolved once per destination and
+    not on every burst"""
+    host, port = address
+    try:
+        packed_ip = socket.inet_aton(host)
+    except OSError:
+        packed_ip = socket.inet_aton(socket.gethostbyname(host))
+    return (struct.pack("=H", socket.AF_INET) + struct.pack("!H", port)
+            + packed_ip + bytes(8))
+
+
+def _decode_address(sockaddr: bytes):
+    port = int.from_bytes(sockaddr[2:4], byteorder="big")
+    return (socket.inet_ntoa(sockaddr[4:8]), port)
+
+
+def _wait_for(sock, events, timeout):
+    """Block until sock is ready, honoring the socket timeout like
+    recvfrom/sendto would"""
+    poller = select.poll()
+    poller.register(sock, events)
+    ms = None if timeout is None else timeout * 1000
+    if not poller.poll(ms):
+        raise socket.timeout("timed out")
+
+
+def _raise_errno(err):
+    raise OSError(err, os.strerror(err))
+
+
+def sendmany(sock, packets, address):
+    """Send every packet in packets to address, with a single sendmmsg
+    call when possible. sock can also be an asyncio transport"""
+    if hasattr(sock, "sendmany"):
+        # SharedSocket, serializes its own sends
+        return sock.sendmany(packets, address)
+
+    if (len(packets) == 1 or not HAS_MMSG
+            or not isinstance(sock, socket.socket)):
+        for packet in packets:
+            sock.sendto(packet, address)
+        return
+
+    count = len(packets)
+    sockaddr = _encode_address(address)
+    name = ctypes.create_string_buffer(sockaddr, len(sockaddr))
+    iovecs = (_IoVec * count)()
+    msgs = (_MMsgHdr * count)()
+
+    # c_char_p apunta al buffer de cada bytes, sin copiarlo
+    payloads = [ctypes.c_char_p(bytes(packet)) for packet in packets]
+    for i, packet in enumerate(payloads):
+        iovecs[i].iov_base = ctypes.cast(packet, ctypes.c_void_p)
+        iovecs[i].iov_len = len(packets[i])
+        header = msgs[i].msg_hdr
+        header.msg_name = ctypes.cast(name, ctypes.c_void_p)
+        header.msg_namelen = len(sockaddr)
+        header.msg_iov = ctypes.pointer(iovecs[i])
+        header.msg_iovlen = 1
+
+    fd = sock.fileno()
+    msgs_address = ctypes.addressof(msgs)
+    sent = 0
+    while sent < count:
+        pending = ctypes.cast(msgs_address + sent * ctypes.sizeof(_MMsgHdr),
+                              ctypes.POINTER(_MMsgHdr))
+        n = _libc.sendmmsg(fd, pending, count - sent, 0)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _wait_for(sock, select.POLLOUT, sock.gettimeout())
+            elif err != errno.EINTR:
+                _raise_errno(err)
+            continue
+        sent += n
+
+
+class BatchReceiver:
+    """Receives up to batch_size datagrams per recvmmsg call. Buffers are
+    allocated once and reused on every call.
+
+    With a BufferPool the datagrams are received straight into pooled
+    buffers (recvfrom_into without recvmmsg) and returned as PooledBuffer
+    instead of bytes, no copy is made"""
+
+    def __init__(self, batch_size=BATCH_SIZE, bufsize=BUFFER_SIZE,
+                 pool=None):
+        self.bufsize = bufsize
+        self.batch_size = batch_size if HAS_MMSG else 1
+        self.pool = pool
+        if not HAS_MMSG:
+            return
+
+        # Con un pool se recibe en sus buffers, que se asignan en cada
+        # llamada: los propios serían memoria muerta
+        self.buffers = None
+        if pool is None:
+            self.buffers = (ctypes.c_char * (bufsize * batch_size))()
+        self.names = (ctypes.c_char * (SOCKADDR_IN_SIZE * batch_size))()
+        self.iovecs = (_IoVec * batch_size)()
+        self.msgs = (_MMsgHdr * batch_size)()
+
+        names_address = ctypes.addressof(self.names)
+        for i in range(batch_size):
+            if self.buffers is not None:
+                self.iovecs[i].iov_base = (ctypes.addressof(self.buffers)
+                                           + i * bufsize)
+            self.iovecs[i].iov_len = bufsize
+            header = self.msgs[i].msg_hdr
+            header.msg_name = names_address + i * SOCKADDR_IN_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+    def recv_batch(self, sock) -> list:
+        """Block like recvfrom for the first datagram (raises
+        socket.timeout), then return every datagram already queued up
+        to batch_size, as a list of (data, address)"""
+        if self.pool is not None and not HAS_MMSG:
+            pooled = self.pool.acquire()
+            try:
+                nbytes, address = sock.recvfrom_into(pooled.buffer)
+            except Exception:
+                self.pool.release(pooled)
+                raise
+            pooled.set_length(nbytes)
+            return [(pooled, address)]
+
+        if not HAS_MMSG:
+            return [sock.recvfrom(self.bufsize)]
+
+        pooled = None
+        if self.pool is not None:
+            pooled = [self.pool.acquire() for _ in range(self.batch_size)]
+            for i, pooled_buffer in enumerate(pooled):
+                self.iovecs[i].iov_base = pooled_buffer.address
+        try:
+            n = self._recvmmsg(sock)
+        except Exception:
+            for pooled_buffer in pooled or []:
+                self.pool.release(pooled_buffer)
+            raise
+
+        datagrams = []
+        for i in range(n):
+            name = self.names[i * SOCKADDR_IN_SIZE:
+                              (i + 1) * SOCKADDR_IN_SIZE]
+            if pooled is not None:
+                pooled[i].set_length(self.msgs[i].msg_len)
+                data = pooled[i]
+            else:
+                data = ctypes.string_at(
+                    ctypes.addressof(self.buffers) + i * self.bufsize,
+                    self.msgs[i].msg_len)
+            datagrams.append((data, _decode_address(name)))
+
+        for pooled_buffer in (pooled or [])[n:]:
+            self.pool.release(pooled_buffer)
+        return datagrams
+
+    def _recvmmsg(self, sock) -> int:
+        fd = sock.fileno()
+        while True:
+            _wait_for(sock, select.POLLIN, sock.gettimeout())
+            for i in range(self.batch_size):
+                self.msgs[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+            n = _libc.recvmmsg(fd, self.msgs, self.batch_size,
+                               MSG_DONTWAIT, None)
+            if n >= 0:
+                break
+            err = ctypes.get_errno()
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                _raise_errno(err)
+        return n
@@ -0,0 +1,68 @@
+import ctypes
+from collections import deque
+
+from lib.utils.constants import BUFFER_SIZE, POOL_SIZE
+
+
+class PooledBuffer:
+    """Receive buffer taken from a BufferPool. Behaves like the received
+    datagram (len, indexing and slicing over a memoryview, no copies) and
+    must be released once nothing reads from it anymore"""
+
+    __slots__ = ("pool", "buffer", "address", "view")
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self.buffer = bytearray(size)
+        # Dirección fija del bytearray, para recvmmsg
+        self.address = ctypes.addressof(
+            (ctypes.c_char * size).from_buffer(self.buffer))
+        self.view = None
+
+    def set_length(self, nbytes):
+        self.view = memoryview(self.buffer)[:nbytes]
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, key):
+        return self.view[key]
+
+    def __eq__(self, other):
+        return self.view == other
+
+    def __bytes__(self):
+        return bytes(self.view)
+
+    def release(self):
+        if self.view is None:  # Ya liberado
+            return
+        self.view = None
+        self.pool.release(self)
+
+
+class BufferPool:
+    """Preallocated receive buffers reused across datagrams. When every
+    buffer is in use a new one is allocated, and buffers released beyond
+    capacity are dropped, so forgetting a release only costs reuse"""
+
+    def __init__(self, capacity=POOL_SIZE, size=BUFFER_SIZE):
+        self.capacity = capacity
+        self.size = size
+        self.free = deque(PooledBuffer(self, size) for _ in range(capacity))
+
+    def acquire(self) -> PooledBuffer:
+        try:
+            return self.free.pop()
+        except IndexError:
+            return PooledBuffer(self, self.size)
+
+    def release(self, pooled_buffer):
+        if len(self.free) < self.capacity:
+            self.free.append(pooled_buffer)
+
+
+def release_buffer(data):
+    """Give data back to its pool if it is a PooledBuffer"""
+    if isinstance(data, PooledBuffer):
+        data.release()
@@ -0,0 +1,32 @@
+import zlib
+
+from lib.utils.constants import COMPRESS_LEVEL
+
+
+class ChunkCompressor:
+    """--compress zlib: the file goes as a single zlib stream cut in
+    chunks of size bytes, so a segment carries more than size bytes of
+    the file. Chunks are written in order, the receiver decompresses each
+    one as it comes with a zlib.decompressobj"""
+
+    def __init__(self, size):
+        self.size = size
+        self.compressor = zlib.compressobj(COMPRESS_LEVEL)
+        self.pending = bytearray()
+
+    def chunks(self, data) -> list:
+        """The full chunks ready once data is added"""
+        self.pending += self.compressor.compress(data)
+        return self.cut(self.size)
+
+    def flush(self) -> list:
+        """Every chunk left, at the end of the file"""
+        self.pending += self.compressor.flush()
+        return self.cut(1)
+
+    def cut(self, least) -> list:
+        chunks = []
+        while len(self.pending) >= least:
+            chunks.append(bytes(self.pending[:self.size]))
+            del self.pending[:self.size]
+        return chunks
@@ -0,0 +1,120 @@
+from abc import ABC, abstractmethod
+
+from lib.utils.constants import INITIAL_WINDOW, WINDOW_SIZE
+
+VEGAS_ALPHA = 2  # Segmentos encolados en la red debajo de los cuales crece
+VEGAS_BETA = 4  # Segmentos encolados en la red arriba de los cuales achica
+
+
+class CongestionControl(ABC):
+    """Congestion window of a Selective Repeat sender, in segments. Slow
+    start up to ssthresh, then congestion avoidance (each variant). The
+    first timeout of a segment halves the window, once per window of data;
+    a retransmission timing out again restarts slow start. The window
+    never goes above max_window (--max-inflight)"""
+
+    def __init__(self, max_window=WINDOW_SIZE, stats=None):
+        self.max_window = max(1, max_window)
+        self.cwnd = float(min(INITIAL_WINDOW, self.max_window))
+        self.ssthresh = float(self.max_window)
+        # Pérdidas de seqs menores ya achicaron la ventana
+        self.recover = 0
+        self.stats = stats
+        self.report()
+
+    def restart(self, initial_window):
+        """Start from initial_window segments, the one agreed in the
+        handshake"""
+        self.cwnd = float(max(1, min(initial_window, self.max_window)))
+        self.report()
+
+    @property
+    def window(self) -> int:
+        return max(1, min(self.max_window, int(self.cwnd)))
+
+    def on_ack(self, rtt=None):
+        """A segment was acknowledged for the first time, rtt only if it
+        was sent once (Karn)"""
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1  # Slow start, se duplica en cada RTT
+        else:
+            self.avoid_congestion(rtt)
+        self.cwnd = min(self.cwnd, self.max_window)
+        self.report()
+
+    @abstractmethod
+    def avoid_congestion(self, rtt):
+        """Grow the window past ssthresh, once per acked segment"""
+
+    def on_loss(self, seq, next_seq):
+        """seq timed out for the first time: multiplicative decrease"""
+        if seq < self.recover:
+            return
+        self.recover = next_seq
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = self.ssthresh
+        self.report()
+
+    def on_timeout(self, next_seq):
+        """A retransmission was lost too: back to slow start"""
+        self.recover = next_seq
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = 1.0
+        self.report()
+
+    def report(self):
+        if self.stats is not None:
+            self.stats.cwnd = self.window
+            self.stats.ssthresh = self.ssthresh
+
+
+class RenoCongestion(CongestionControl):
+    """AIMD: one more segment per RTT without losses"""
+
+    def avoid_congestion(self, rtt):
+        self.cwnd += 1 / self.cwnd
+
+
+class DelayCongestion(CongestionControl):
+    """Vegas style: the segments queued in the network are estimated from
+    the RTT growing over the smallest one seen, the window grows while
+    they are under VEGAS_ALPHA and shrinks once they pass VEGAS_BETA.
+    Slow start also ends when they pass VEGAS_BETA"""
+
+    def __init__(self, max_window=WINDOW_SIZE, stats=None):
+        self.base_rtt = None
+        super().__init__(max_window, stats)
+
+    def on_ack(self, rtt=None):
+        if rtt is not None:
+            if self.base_rtt is None or rtt < self.base_rtt:
+                self.base_rtt = rtt
+            if (self.cwnd < self.ssthresh
+                    and self.queued(rtt) > VEGAS_BETA):
+                self.ssthresh = self.cwnd
+        super().on_ack(rtt)
+
+    def queued(self, rtt):
+        if rtt <= 0:
+            return 0.0
+        return self.cwnd * (1 - self.base_rtt / rtt)
+
+    def avoid_congestion(self, rtt):
+        if rtt is None:  # Sin muestra válida no hay información
+            return
+        queued = self.queued(rtt)
+        if queued < VEGAS_ALPHA:
+            self.cwnd += 1 / self.cwnd
+        elif queued > VEGAS_BETA:
+            self.cwnd = max(2.0, self.cwnd - 1 / self.cwnd)
+
+
+CONGESTION_CONTROLS = {
+    "reno": RenoCongestion,
+    "delay": DelayCongestion,
+}
+
+
+def get_congestion_control(name, max_window=WINDOW_SIZE, stats=None):
+    """Congestion controller by its --congestion name"""
+    return CONGESTION_CONTROLS[name](max_window, stats)
@@ -1,8 +1,13 @@
 from dataclasses import dataclass
+import queue
+import threading
 
 from lib.client.downloader import Downloader
 from lib.client.uploader import Uploader
-from lib.utils.constants import DOWNLOAD_OPERATION
+from lib.server.admission import BudgetQueue
+from lib.utils.buffer_pool import release_buffer
+from lib.utils.constants import (
+    CLOSE_MARKER, DOWNLOAD_OPERATION, STOP_AND_WAIT)
 from lib.utils.segments import InitSegment
 from lib.utils.static import get_protocol_name_from_protocol_code
 
@@ -10,12 +15,16 @@ from lib.utils.static import get_protocol_name_from_protocol_code
 @dataclass
 class ConnectionInfo:
     operation_handler: object  # Downloader or Uploader
-    protocol: str     # "sw" for Stop & Wait, "sr" for Selective Repeat
+    protocol: str     # "sw" Stop & Wait, "sr" Selective Repeat, "fec"
     file_path: str    # For upload: filename to create,
     protocol_handler: object  # StopAndWait or SelectiveRepeat instance
     finished: bool = False
 
-    def __init__(self, init_segment: 'InitSegment', client_address, args):
+    def __init__(self, init_segment: 'InitSegment', client_address, args,
+                 sock=None, inbound=None, init_message=b""):
+        """sock: shared server socket, None to give the session its own.
+        inbound: InboundBudget shared by the inboxes of every session.
+        init_message: the INIT as received, to spot its retransmissions"""
 
         # Argumentos para el operation handler
         args.name = ""
@@ -27,16 +36,112 @@ class ConnectionInfo:
 
         if init_segment.opcode == DOWNLOAD_OPERATION:
             args.src = server_path
-            operation_handler = Uploader(args)
+            operation_handler = Uploader(args, sock)
         else:
             args.dst = server_path
-            operation_handler = Downloader(args, False)
+            operation_handler = Downloader(args, False, sock)
 
         self.operation_handler = operation_handler
+        self.protocol = args.protocol
+        self.protocol_handler = operation_handler.protocol_handler
+        if init_segment.protocol != STOP_AND_WAIT:
+            # --max-inflight también vale para lo que sube el cliente
+            self.protocol_handler.recv_limit = args.max_inflight
+        # Una descarga empieza a leer ya, la primera ventana sale apenas
+        # después del INIT_ACK
+        operation_handler.apply_init(init_segment)
+        self.init_segment = init_segment
+        self.init_message = init_message
+        self.inbox = None
+        if inbound is not None:
+            self.inbox = BudgetQueue(inbound)
+            self.protocol_handler.communication_queue = self.inbox
         self.file_path = init_segment.name.decode("utf-8")
+        self.finished = False
+        self.verbose = args.verbose
+        self.worker_thread = None
+        self.stopping = False  # terminate ya mandó CLOSE_MARKER
+        self.reaper = None
+
+    def start(self):
+        """Start the long-lived worker that drives this session"""
+        self.worker_thread = threading.Thread(target=self.run, daemon=True)
+        self.worker_thread.start()
+
+    def run(self):
+        """Session worker: advance the transfer until it is finished.
+        Incoming datagrams reach it through dispatch"""
+        try:
+            while not self.finished:
+                finished = self.operation_handler.transfer(is_client=False)
+                self.set_finished(finished)
+            # Con terminate el CLOSE_MARKER ya lo consumió la transferencia
+            if (isinstance(self.operation_handler, Downloader)
+                    and not self.stopping):
+                self.linger()
+        except Exception as e:
+            if self.verbose:
+                print(f"[SERVER] Session for {self.file_path} failed: {e}")
+            self.set_finished(True)
+        finally:
+            # Nadie más lee el inbox, lo que llegue no ocupa el budget
+            self.close_inbox()
+
+    def linger(self):
+        """After the EOF keep answering until FIN or eviction: if our last
+        ACK was lost the client retransmits the EOF and waits for it"""
+        while True:
+            data = self.protocol_handler.communication_queue.get()
+            if data is CLOSE_MARKER:
+                return
+            run, _, _ = self.protocol_handler.receive_file(data)
+            for _, datagram in run:
+                release_buffer(datagram)
+
+    def is_init(self, data) -> bool:
+        """Whether data is the INIT of this session again: the client did
+        not get the INIT_ACK"""
+        return len(data) == len(self.init_message) \
+            and data == self.init_message
+
+    def dispatch(self, data):
+        """Hand a datagram to this session's inbox (protocol queue).
+        Only a Downloader releases pooled buffers after writing them, the
+        rest get a copy so the buffer goes back to the pool right away"""
+        if not isinstance(self.operation_handler, Downloader):
+            data, pooled = bytes(data), data
+            release_buffer(pooled)
+        try:
+            self.protocol_handler.put_bytes(data)
+        except queue.Full:
+            # Sin lugar en el budget global, el cliente retransmite
+            release_buffer(data)
+            if self.verbose:
+                print(f"[SERVER] Inbound queue full, dropping datagram "
+                      f"for {self.file_path}")
 
     def set_finished(self, finished):
         self.finished = finished
 
     def terminate(self):
+        """Stop the session, on FIN or when evicted. Segments already in
+        the inbox are handled before the worker sees CLOSE_MARKER. Runs
+        on the receive thread of every session, so whatever waits for the
+        worker is left to a reaper thread"""
+        self.stopping = True
+        self.protocol_handler.communication_queue.put_nowait(CLOSE_MARKER)
+        self.reaper = threading.Thread(target=self.teardown, daemon=True)
+        self.reaper.start()
+
+    def teardown(self):
+        """Wait for the worker and release what the session holds"""
+        self.protocol_handler.stop()
+        if self.worker_thread is not None:
+            self.worker_thread.join(timeout=1)
+        self.close_inbox()
+        self.set_finished(True)
         self.operation_handler.terminate()
+
+    def close_inbox(self):
+        if self.inbox is not None:
+            self.inbox.close()
@@ -1,12 +1,24 @@
-BUFFER_SIZE = 1400  # Buffer size for receiving/sending data
+BUFFER_SIZE = 1400  # Default segment size, each session negotiates its own
+
+MIN_SEGMENT_SIZE = 64  # Smallest segment size a session can negotiate
+
+MAX_SEGMENT_SIZE = 65507  # Largest UDP payload over IPv4
+
+BATCH_SIZE = 32  # Maximum datagrams per recvmmsg/sendmmsg call
+
+POOL_SIZE = 256  # Receive buffers kept in a BufferPool
 
 HEADER_SIZE_SW = 7  # Packet header size, 1 flags, 2 length payload, 4 checksum
 
 HEADER_SIZE_SR = 13
 
-DATA_SIZE = BUFFER_SIZE - HEADER_SIZE_SW  # Maximum packet data size
+FEC_HEADER_SIZE = 3  # Flags and length of a segment, inside the parity
+
+TIMEOUT = 0.1  # Timeout to receive an ACK, until there is an RTT sample
 
-TIMEOUT = 0.1  # Timeout to receive an ACK
+MIN_RTO = 0.2  # Minimum retransmission timeout, above ACK delay and jitter
+
+MAX_RTO = 2.0  # Maximum retransmission timeout, after backoff
 
 APPEND_MODE = "ab"  # Append mode for binary files
 
@@ -16,8 +28,72 @@ READ_MODE = "rb"  # Read mode for binary files
 
 EOF_MARKER = object()
 
+CLOSE_MARKER = object()  # Stops a worker before the transfer is complete
+
 MAX_ATTEMPTS = 10  # Maximum sending attempts
 
+INIT_TIMEOUT = 0.25  # First wait for the INIT_ACK, doubles on every resend
+
+INIT_ATTEMPTS = 8  # INITs sent before giving up on the server
+
+EARLY_DATA = 64  # Datagrams of a download kept while the INIT_ACK is late
+
+IDLE_TIMEOUT = 30.0  # Seconds without messages before evicting a session
+
+MAX_SESSIONS = 1024  # Maximum concurrent sessions on the server
+
+SWEEP_INTERVAL = 1.0  # Minimum seconds between idle session sweeps
+
+MAX_TRANSFERS = 64  # Maximum transfers in progress on the server
+
+MAX_QUEUE = 4096  # Maximum datagrams queued for all the server sessions
+
+WINDOW_SIZE = 64  # Maximum Selective Repeat segments in flight per session
+
+RECV_WINDOW = 256  # Selective Repeat segments a receiver buffers
+
+READ_AHEAD = 256  # Chunks an Uploader reads ahead of the protocol
+
+INITIAL_WINDOW = 4  # Selective Repeat congestion window at the start
+
+CONGESTION = "reno"  # Default Selective Repeat congestion control
+
+ACK_EVERY = 2  # In order Selective Repeat segments covered by one ACK
+
+ACK_DELAY = 0.005  # Seconds an incomplete ACK waits for more segments
+
+MAX_ACK_DELAY = 0.05  # Longest --ack-delay, senders add it to the RTO
+
+DUP_THRESH = 3  # Segments acked past an unacked one that mark it as lost
+
+RATE = 0  # Session pacing in bytes per second, 0 turns it off
+
+PACING_BURST = 4 * BUFFER_SIZE  # Bytes a paced session sends back to back
+
+PACING_GAIN = 2.0  # With --rate auto, paced at this many windows per RTT
+
+FEC_BLOCK = 8  # Data segments per FEC block
+
+FEC_PARITY = 1  # Parity segments per FEC block, one per interleaved group
+
+MAX_FEC_PENDING = 64  # Parity segments a receiver keeps waiting for data
+
+PMTU_FLOOR = 548  # Segment every IPv4 path carries whole (576 - 28)
+
+PMTU_TIMEOUT = 0.2  # Seconds to wait for the echo of a PMTU probe
+
+PMTU_ATTEMPTS = 2  # Probes of a size before deciding it does not fit
+
+INIT_VERSION = 1  # Newest extended INIT format this end speaks
+
+COMPRESS_LEVEL = 1  # zlib level for --compress zlib, fast over small
+
+LEGACY_ERROR = b"ERROR: Internal server error"  # Pre-extended INIT servers
+
+RETRY_AFTER = 1.0  # Seconds a busy server asks the client to wait
+
+METRICS_INTERVAL = 5.0  # Seconds between metrics file dumps
+
 # Operation Types
 DOWNLOAD_OPERATION = 0b0
 UPLOAD_OPERATION = 0b1
@@ -25,3 +101,12 @@ UPLOAD_OPERATION = 0b1
 # Protocol Types
 STOP_AND_WAIT = 0b0
 SELECTIVE_REPEAT = 0b1
+FORWARD_ERROR_CORRECTION = 0b10
+
+# Compression Types
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+# Checksum Types
+CHECKSUM_CRC32 = 0
+CHECKSUM_NONE = 1  # Solo el checksum de UDP
@@ -1,4 +1,28 @@
+import ctypes
+import errno
 import os
+import sys
+
+FALLOC_FL_KEEP_SIZE = 0x01  # Reserva bloques sin cambiar el tamaño
+
+
+def _load_fallocate():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+    fallocate = getattr(libc, "fallocate64", None)
+    if fallocate is None:
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64,
+                          ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
 
 
 class FileManager:
@@ -42,6 +66,43 @@ class FileManager:
         else:
             print("File not opened in binary append mode.")
 
+    def append_many(self, chunks):
+        """Append a run of chunks with a single call"""
+        if self.file and ("ab" in self.mode):
+            try:
+                self.file.writelines(chunks)
+            except Exception as e:
+                print(f"Error appending to file: {e}")
+        else:
+            print("File not opened in binary append mode.")
+
+    def seek(self, offset):
+        """Read from offset on, to resume a transfer"""
+        if self.file:
+            self.file.seek(offset)
+
+    def truncate(self, size):
+        """Drop what is past size, a partial file that cannot be resumed
+        from where it ends"""
+        if self.file:
+            self.file.truncate(size)
+
+    def preallocate(self, nbytes):
+        """Reserve nbytes past the end of the file (Linux), appends then
+        find their blocks already allocated and the file is less
+        fragmented. A full disk raises OSError before the transfer
+        starts, anything else (no support) is ignored"""
+        if not self.file or _fallocate is None or nbytes <= 0:
+            return
+        self.file.flush()
+        offset = os.fstat(self.file.fileno()).st_size
+        if _fallocate(self.file.fileno(), FALLOC_FL_KEEP_SIZE,
+                      offset, nbytes) == 0:
+            return
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise OSError(err, os.strerror(err), self.path)
+
     def close(self):
         if self.file:
             try:
@@ -0,0 +1,164 @@
+import threading
+import time
+
+COUNTERS = ("bytes_in", "bytes_out", "packets_in", "packets_out",
+            "retransmits", "fast_retransmits", "crc_failures", "duplicates",
+            "acks_out", "acks_delayed", "fec_parity", "fec_recovered")
+
+
+class SessionStats:
+    """Counters of one protocol handler, that is one session on the
+    server. Updated without locks from the threads of the session, a
+    count can be off by a few under contention"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.rtt_samples = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = None
+        self.rtt_max = 0.0
+        self.rtt_last = None
+        # Los reporta el RttEstimator de la sesión
+        self.rto = None
+        self.srtt = None
+        # Los reporta el control de congestión (Selective Repeat)
+        self.cwnd = None
+        self.ssthresh = None
+        # Espacio libre que anunció el receptor (Selective Repeat)
+        self.rwnd = None
+        # Pacing en bytes por segundo, 0 sin pacing
+        self.rate = None
+        # Política de ACKs del receptor (Selective Repeat)
+        self.ack_every = None
+        self.ack_delay = None
+
+    def sent(self, nbytes, packets=1):
+        self.bytes_out += nbytes
+        self.packets_out += packets
+
+    def retransmitted(self, nbytes, packets=1):
+        self.sent(nbytes, packets)
+        self.retransmits += packets
+
+    def received(self, nbytes):
+        self.bytes_in += nbytes
+        self.packets_in += 1
+
+    def add_rtt(self, rtt):
+        """RTT sample, only from segments sent once (Karn)"""
+        self.rtt_samples += 1
+        self.rtt_sum += rtt
+        self.rtt_last = rtt
+        self.rtt_max = max(self.rtt_max, rtt)
+        if self.rtt_min is None or rtt < self.rtt_min:
+            self.rtt_min = rtt
+
+    def as_dict(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        stats = {name: getattr(self, name) for name in COUNTERS}
+        stats.update(
+            elapsed=round(elapsed, 3),
+            throughput_in=round(self.bytes_in / elapsed),
+            throughput_out=round(self.bytes_out / elapsed),
+            rtt_samples=self.rtt_samples,
+            rtt_avg=_rtt_avg(self.rtt_sum, self.rtt_samples),
+            rtt_min=self.rtt_min,
+            rtt_max=self.rtt_max,
+            rtt_last=self.rtt_last,
+            rto=self.rto,
+            srtt=self.srtt,
+            cwnd=self.cwnd,
+            ssthresh=self.ssthresh,
+            rwnd=self.rwnd,
+            rate=self.rate,
+            ack_every=self.ack_every,
+            ack_delay=self.ack_delay,
+        )
+        return stats
+
+
+def _rtt_avg(rtt_sum, samples):
+    return rtt_sum / samples if samples else None
+
+
+class MetricsRegistry:
+    """Process wide metrics: the stats of the live sessions, the totals
+    of the ones already closed, server counters and gauges (functions
+    read on every snapshot)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.sessions = {}
+        self.counters = {}
+        self.gauges = {}
+        self.retired = dict.fromkeys(COUNTERS, 0)
+        self.retired.update(rtt_samples=0, rtt_sum=0.0)
+
+    def register(self, label, stats: SessionStats):
+        with self.lock:
+            self.sessions[label] = stats
+
+    def unregister(self, label):
+        """Forget a closed session, its counts stay in the totals"""
+        with self.lock:
+            stats = self.sessions.pop(label, None)
+            if stats is None:
+                return
+            for name in COUNTERS:
+                self.retired[name] += getattr(stats, name)
+            self.retired["rtt_samples"] += stats.rtt_samples
+            self.retired["rtt_sum"] += stats.rtt_sum
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            sessions = {label: stats.as_dict()
+                        for label, stats in self.sessions.items()}
+            totals = dict(self.retired)
+            counters = dict(self.counters)
+
+        for stats in sessions.values():
+            for name in COUNTERS:
+                totals[name] += stats[name]
+            totals["rtt_samples"] += stats["rtt_samples"]
+            if stats["rtt_avg"] is not None:
+                totals["rtt_sum"] += stats["rtt_avg"] * stats["rtt_samples"]
+        totals["rtt_avg"] = _rtt_avg(totals.pop("rtt_sum"),
+                                     totals["rtt_samples"])
+
+        return {
+            "uptime": round(time.monotonic() - self.started, 3),
+            "totals": totals,
+            "server": counters,
+            "gauges": {name: read() for name, read in self.gauges.items()},
+            "sessions": sessions,
+        }
+
+    def render_text(self) -> str:
+        """Snapshot as "name value" lines, per session ones with a
+        session="host:port" label"""
+        snapshot = self.snapshot()
+        lines = [f"uptime_seconds {snapshot['uptime']}"]
+        for group in ("totals", "server", "gauges"):
+            for name, value in snapshot[group].items():
+                if value is not None:
+                    lines.append(f"{name} {value}")
+        for label, stats in snapshot["sessions"].items():
+            for name, value in stats.items():
+                if value is not None:
+                    lines.append(f'session_{name}{{session="{label}"}} '
+                                 f"{value}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro del proceso (cada worker de --workers tiene el suyo)
+registry = MetricsRegistry()
@@ -0,0 +1,60 @@
+import time
+
+from lib.utils.constants import MAX_RTO, MIN_RTO, TIMEOUT
+
+ALPHA = 1 / 8  # Peso de cada muestra en SRTT
+BETA = 1 / 4  # Peso de cada muestra en RTTVAR
+CLOCK_GRANULARITY = 0.001
+
+
+class RttEstimator:
+    """Retransmission timeout of a session (RFC 6298): SRTT and RTTVAR
+    from the RTT samples, exponential backoff on every timeout and
+    MIN_RTO/MAX_RTO clamps. Callers apply Karn's rule, only segments sent
+    once are sampled. ack_delay is the longest the peer may hold an ACK,
+    added to the RTO. The current rto and srtt are reported in stats"""
+
+    def __init__(self, stats=None, ack_delay=0):
+        self.ack_delay = ack_delay
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.clamp(TIMEOUT)  # Hasta la primera muestra
+        self.backed_off = None  # Cuándo fue el último backoff
+        self.stats = stats
+        self.report()
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = ((1 - BETA) * self.rttvar
+                           + BETA * abs(self.srtt - rtt))
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        # Una muestra nueva también descarta el backoff acumulado
+        self.backed_off = None
+        self.rto = self.clamp(
+            self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+            + self.ack_delay)
+        self.report()
+
+    def backoff(self):
+        """A segment timed out: double the timeout until the next sample.
+        Segments sent together time out together, so like the single
+        timer of TCP it doubles at most once per RTO"""
+        now = time.monotonic()
+        if (self.backed_off is not None
+                and now - self.backed_off < self.rto / 2):
+            return
+        self.backed_off = now
+        self.rto = self.clamp(self.rto * 2)
+        self.report()
+
+    @staticmethod
+    def clamp(rto):
+        return min(MAX_RTO, max(MIN_RTO, rto))
+
+    def report(self):
+        if self.stats is not None:
+            self.stats.rto = self.rto
+            self.stats.srtt = self.srtt
@@ -1,17 +1,104 @@
 import zlib
-from lib.utils.constants import (DOWNLOAD_OPERATION, STOP_AND_WAIT)
+from lib.utils.constants import (
+    BUFFER_SIZE, CHECKSUM_CRC32, COMPRESSION_NONE, DOWNLOAD_OPERATION,
+    INIT_VERSION, STOP_AND_WAIT)
+
+PROBE_FLAG = 0b1000000  # Bit 6 del primer byte, ningún INIT lo usa
+
+EXTENDED_FLAG = 0b10000000  # Bit 7: INIT extendido, con versión y opciones
+
+# Opciones del INIT extendido, como código: (atributo, bytes del valor).
+# Viajan como tipo, largo y valor, solo las que no tienen su valor por
+# defecto. Las que no se conocen se saltean, así una versión nueva puede
+# agregar más sin romper a las anteriores
+INIT_OPTIONS = {
+    1: ("file_size", 8),
+    2: ("segment_size", 2),
+    3: ("initial_window", 2),
+    4: ("compression", 1),
+    5: ("checksum", 1),
+    6: ("resume_offset", 8),
+}
+
+INIT_DEFAULTS = {
+    "file_size": None,
+    "segment_size": BUFFER_SIZE,
+    "initial_window": None,
+    "compression": COMPRESSION_NONE,
+    "checksum": CHECKSUM_CRC32,
+    "resume_offset": None,
+}
 
 
 class InitSegment:
     def __init__(self, opcode=DOWNLOAD_OPERATION, protocol=STOP_AND_WAIT,
-                 ack=0b0, name=b""):
+                 ack=0b0, name=b"", busy=0b0, segment_size=BUFFER_SIZE,
+                 version=0, file_size=None, initial_window=None,
+                 compression=COMPRESSION_NONE, checksum=CHECKSUM_CRC32,
+                 resume_offset=None):
         self.ack = ack & 0b1
         self.opcode = opcode & 0b1
-        self.protocol = protocol & 0b1
+        self.protocol = protocol & 0b11
         self.name = name
+        # Respuesta de servidor ocupado: sin ack, el nombre lleva los
+        # milisegundos a esperar antes de reintentar
+        self.busy = busy & 0b1
+        # Pedido en el INIT, negociado en el INIT_ACK. Solo viaja si no es
+        # el de siempre, así los INIT por defecto no cambian
+        self.segment_size = segment_size
+        # 0 es el formato original, que solo lleva el tamaño de segmento.
+        # Desde la 1 las opciones van como TLV
+        self.version = version
+        self.file_size = file_size
+        self.initial_window = initial_window
+        self.compression = compression
+        self.checksum = checksum
+        # En el INIT: bytes que el cliente ya tiene (descarga) o pedido de
+        # retomar (subida, en 0). En el INIT_ACK: desde dónde se envía
+        self.resume_offset = resume_offset
+
+    @property
+    def sized(self) -> int:
+        return int(not self.version and self.segment_size != BUFFER_SIZE)
+
+    @staticmethod
+    def busy_reply(init_segment, retry_after) -> 'InitSegment':
+        return InitSegment(init_segment.opcode, init_segment.protocol, 0b0,
+                           str(int(retry_after * 1000)), 0b1)
+
+    @staticmethod
+    def ack_reply(init_segment) -> 'InitSegment':
+        """INIT_ACK carrying the parameters agreed for init_segment, in
+        the newest format both ends speak"""
+        return InitSegment(
+            init_segment.opcode, init_segment.protocol, 0b1, "", 0b0,
+            init_segment.segment_size,
+            min(init_segment.version, INIT_VERSION),
+            init_segment.file_size, init_segment.initial_window,
+            init_segment.compression, init_segment.checksum,
+            init_segment.resume_offset)
+
+    def retry_after(self) -> float:
+        """Seconds to wait before retrying, for busy replies"""
+        return int(self.name or 0) / 1000
 
     def _build_header(self):
-        return (self.ack << 2) | (self.opcode << 1) | self.protocol
+        # El bit alto del protocolo va arriba de busy, sw y sr siguen
+        # codificándose igual que antes. En el formato original el bit 5
+        # avisa que viaja el tamaño de segmento
+        extended = EXTENDED_FLAG if self.version else 0
+        return (extended | (self.sized << 5) | ((self.protocol >> 1) << 4)
+                | (self.busy << 3) | (self.ack << 2) | (self.opcode << 1)
+                | (self.protocol & 0b1))
+
+    def _build_options(self) -> bytes:
+        options = b""
+        for code, (attribute, size) in INIT_OPTIONS.items():
+            value = getattr(self, attribute)
+            if value != INIT_DEFAULTS[attribute]:
+                options += (bytes([code, size])
+                            + value.to_bytes(size, byteorder="big"))
+        return options
 
     def serialize(self, verbose=False):
         if verbose:
@@ -19,16 +106,27 @@ class InitSegment:
                   f"\n\t- ack: {self.ack}"
                   f"\n\t- opcode: {self.opcode}"
                   f"\n\t- protocol: {self.protocol}"
-                  f"\n\t- name: {self.name}")
+                  f"\n\t- name: {self.name}"
+                  f"\n\t- version: {self.version}"
+                  f"\n\t- segment size: {self.segment_size}")
 
         header_byte = self._build_header()
         header_bytes = bytes([header_byte])
 
         name_bytes = self.name.encode("utf-8")
         name_length = len(name_bytes)
-        name_length_byte = name_length.to_bytes(1, byteorder="big")
 
-        packet_to_crc = header_bytes + name_length_byte + name_bytes
+        if self.version:
+            # Versión, nombre con largo de 2 bytes y las opciones
+            packet_to_crc = (header_bytes + bytes([self.version])
+                             + name_length.to_bytes(2, byteorder="big")
+                             + name_bytes + self._build_options())
+        else:
+            name_length_byte = name_length.to_bytes(1, byteorder="big")
+            packet_to_crc = header_bytes + name_length_byte + name_bytes
+            if self.sized:
+                packet_to_crc += self.segment_size.to_bytes(
+                    2, byteorder="big")
         crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF
         crc_bytes = crc.to_bytes(4, byteorder="big")
 
@@ -48,30 +146,128 @@ class InitSegment:
             raise ValueError("Packet too short")
 
         header_byte = data[0]
-        name_length = data[1]
+        if header_byte & EXTENDED_FLAG:
+            init_segment = InitSegment._deserialize_extended(data)
+        else:
+            init_segment = InitSegment._deserialize_legacy(data)
 
-        if len(data) < (2 + name_length + 4):
-            raise ValueError("Incomplete packet")
+        init_segment.busy = (header_byte >> 3) & 0b1
+        init_segment.ack = (header_byte >> 2) & 0b1
+        init_segment.opcode = (header_byte >> 1) & 0b1
+        init_segment.protocol = ((((header_byte >> 4) & 0b1) << 1)
+                                 | (header_byte & 0b1))
 
-        file_name = data[2:2 + name_length]
-        crc_received = int.from_bytes(data[2 + name_length:], byteorder="big")
-        crc_calculated = zlib.crc32(data[:2 + name_length]) & 0xFFFFFFFF
+        if verbose:
+            print("Deserialize InitSegment result:"
+                  f"\n\t opcode: {init_segment.opcode}"
+                  f"\n\t protocol: {init_segment.protocol}"
+                  f"\n\t ack: {init_segment.ack}"
+                  f"\n\t busy: {init_segment.busy}"
+                  f"\n\t name: {init_segment.name}"
+                  f"\n\t version: {init_segment.version}"
+                  f"\n\t segment size: {init_segment.segment_size}")
+
+        return init_segment
+
+    @staticmethod
+    def _check_crc(data, end):
+        crc_received = int.from_bytes(data[end:], byteorder="big")
+        crc_calculated = zlib.crc32(data[:end]) & 0xFFFFFFFF
 
         if crc_calculated != crc_received:
             raise ValueError("CRC mismatch")
 
-        ack = (header_byte >> 2) & 0b1
-        opcode = (header_byte >> 1) & 0b1
-        protocol = header_byte & 0b1
+    @staticmethod
+    def _deserialize_legacy(data) -> 'InitSegment':
+        name_length = data[1]
 
-        if verbose:
-            print("Deserialize InitSegment result:"
-                  f"\n\t opcode: {opcode}"
-                  f"\n\t protocol: {protocol}"
-                  f"\n\t ack: {ack}"
-                  f"\n\t name: {file_name}")
+        # El tamaño de segmento va entre el nombre y el CRC
+        sized = (data[0] >> 5) & 0b1
+        end = 2 + name_length + 2 * sized
+
+        if len(data) < (end + 4):
+            raise ValueError("Incomplete packet")
+        InitSegment._check_crc(data, end)
+
+        init_segment = InitSegment(name=bytes(data[2:2 + name_length]))
+        if sized:
+            init_segment.segment_size = int.from_bytes(
+                data[end - 2:end], byteorder="big")
+        return init_segment
+
+    @staticmethod
+    def _deserialize_extended(data) -> 'InitSegment':
+        if len(data) < 8:
+            raise ValueError("Packet too short")
+
+        end = len(data) - 4
+        InitSegment._check_crc(data, end)
+
+        name_length = int.from_bytes(data[2:4], byteorder="big")
+        position = 4 + name_length
+        if position > end:
+            raise ValueError("Incomplete packet")
+
+        init_segment = InitSegment(name=bytes(data[4:position]),
+                                   version=data[1])
+        while position < end:
+            if position + 2 > end:
+                raise ValueError("Incomplete option")
+            code, size = data[position], data[position + 1]
+            if position + 2 + size > end:
+                raise ValueError("Incomplete option")
+            value = data[position + 2:position + 2 + size]
+            if code in INIT_OPTIONS:
+                setattr(init_segment, INIT_OPTIONS[code][0],
+                        int.from_bytes(value, byteorder="big"))
+            position += 2 + size
+        return init_segment
+
+
+def is_handshake(data, init_ack) -> bool:
+    """Whether a datagram that reaches a client during the transfer is
+    left over from the handshake: a copy of init_ack, a busy or error
+    reply or a PMTU echo. Data segments and ACKs only use the 3 low bits
+    of their first byte"""
+    return not len(data) or data[0] > 0b111 or data == init_ack
+
+
+class ProbeSegment:
+    """Path MTU probe: size bytes with DF set, padded with zeros. The
+    server echoes a short ack carrying the size that reached it whole,
+    without opening a session"""
+
+    def __init__(self, size, ack=0b0):
+        self.size = size
+        self.ack = ack & 0b1
+
+    def serialize(self):
+        header = (bytes([PROBE_FLAG | (self.ack << 2)])
+                  + self.size.to_bytes(2, byteorder="big"))
+        padding = b"" if self.ack else bytes(max(0, self.size - 7))
+        packet_to_crc = header + padding
+        crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF
+        return packet_to_crc + crc.to_bytes(4, byteorder="big")
+
+    @staticmethod
+    def is_probe(data) -> bool:
+        return len(data) > 0 and bool(data[0] & PROBE_FLAG)
 
-        return InitSegment(opcode, protocol, ack, file_name)
+    @staticmethod
+    def deserialize(data) -> 'ProbeSegment':
+        if len(data) < 7:
+            raise ValueError("Packet too short")
+
+        crc_received = int.from_bytes(data[-4:], byteorder="big")
+        crc_calculated = zlib.crc32(data[:-4]) & 0xFFFFFFFF
+        if crc_calculated != crc_received:
+            raise ValueError("CRC mismatch")
+
+        ack = (data[0] >> 2) & 0b1
+        size = int.from_bytes(data[1:3], byteorder="big")
+        if not ack and size != len(data):
+            raise ValueError("Truncated probe")
+        return ProbeSegment(size, ack)
 
 
 class StopAndWaitSegment:
@@ -85,12 +281,13 @@ class StopAndWaitSegment:
     def _build_header(self):
         return (self.seq_num << 2) | (self.ack_num << 1) | self.eof_num
 
-    def serialize(self, verbose=False):
+    def serialize(self, verbose=False, crc=True):
+        """crc False (--checksum none) leaves the CRC in 0"""
         header_byte = self._build_header()
         header_bytes = bytes([header_byte])
         payload_len_bytes = len(self.payload).to_bytes(2, byteorder="big")
         packet_to_crc = header_bytes + payload_len_bytes + self.payload
-        crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF
+        crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF if crc else 0
         crc_bytes = crc.to_bytes(4, byteorder="big")
 
         final_packet = packet_to_crc + crc_bytes
@@ -107,7 +304,7 @@ class StopAndWaitSegment:
         return final_packet
 
     @staticmethod
-    def deserialize(data, verbose) -> 'StopAndWaitSegment':
+    def deserialize(data, verbose, crc=True) -> 'StopAndWaitSegment':
         if len(data) < 7:
             raise ValueError("Packet too short")
 
@@ -120,10 +317,11 @@ class StopAndWaitSegment:
         payload = data[3:3 + payload_len]
         crc_received = int.from_bytes(data[3 + payload_len:3 +
                                            payload_len + 4], byteorder="big")
-        crc_calculated = zlib.crc32(data[:3 + payload_len]) & 0xFFFFFFFF
+        if crc:
+            crc_calculated = zlib.crc32(data[:3 + payload_len]) & 0xFFFFFFFF
 
-        if crc_calculated != crc_received:
-            raise ValueError("CRC mismatch")
+            if crc_calculated != crc_received:
+                raise ValueError("CRC mismatch")
 
         seq_num = (header_byte >> 2) & 0b1
         ack_num = (header_byte >> 1) & 0b1
@@ -141,25 +339,33 @@ class StopAndWaitSegment:
 
 class SelectiveRepeatSegment:
     def __init__(self, payload=b"", seq_num=0, ack_num=0,
-                 win_size=0, eof_num=0):
+                 win_size=0, eof_num=0, sack=0, parity=0):
         self.payload = payload
         self.seq_num = seq_num & 0xFFFF
         self.ack_num = ack_num & 0xFFFF
         self.win_size = win_size & 0xFFFF
         self.eof_num = eof_num & 0b1
-
-    def serialize(self, verbose=False):
+        # ACK: ack_num es el próximo seq esperado (acumulativo) y el
+        # payload un bitmap de los siguientes ya recibidos (SACK)
+        self.sack = sack & 0b1
+        # Paridad FEC: seq_num es el primero del bloque, ack_num el grupo
+        # y win_size el tamaño del bloque y la cantidad de grupos
+        self.parity = parity & 0b1
+
+    def serialize(self, verbose=False, crc=True):
+        """crc False (--checksum none) leaves the CRC in 0"""
         payload_len_bytes = len(self.payload).to_bytes(2, byteorder="big")
         seq_num_bytes = self.seq_num.to_bytes(2, byteorder="big")
         ack_num_bytes = self.ack_num.to_bytes(2, byteorder="big")
         win_size_bytes = self.win_size.to_bytes(2, byteorder="big")
-        eof_byte = bytes([self.eof_num])
+        eof_byte = bytes([(self.parity << 2) | (self.sack << 1)
+                          | self.eof_num])
 
         packet_to_crc = (
             eof_byte + seq_num_bytes + ack_num_bytes +
             win_size_bytes + payload_len_bytes + self.payload
         )
-        crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF
+        crc = zlib.crc32(packet_to_crc) & 0xFFFFFFFF if crc else 0
         crc_bytes = crc.to_bytes(4, byteorder="big")
 
         final_packet = packet_to_crc + crc_bytes
@@ -170,6 +376,8 @@ class SelectiveRepeatSegment:
                   f"\n\tAck: {self.ack_num}"
                   f"\n\tWin: {self.win_size}"
                   f"\n\tEOF: {self.eof_num}"
+                  f"\n\tSACK: {self.sack}"
+                  f"\n\tParity: {self.parity}"
                   f"\n\tPayload Length: {len(self.payload)}"
                   f"\n\tCRC: {hex(crc)}"
                   f"\n\tSerialized Packet: {final_packet}")
@@ -177,11 +385,13 @@ class SelectiveRepeatSegment:
         return final_packet
 
     @staticmethod
-    def deserialize(data) -> 'SelectiveRepeatSegment':
+    def deserialize(data, crc=True) -> 'SelectiveRepeatSegment':
         if len(data) < 13:
             raise ValueError("Packet too short")
 
-        eof_num = data[0]
+        eof_num = data[0] & 0b1
+        sack = (data[0] >> 1) & 0b1
+        parity = (data[0] >> 2) & 0b1
         seq_num = int.from_bytes(data[1:3], byteorder="big")
         ack_num = int.from_bytes(data[3:5], byteorder="big")
         win_size = int.from_bytes(data[5:7], byteorder="big")
@@ -192,10 +402,11 @@ class SelectiveRepeatSegment:
 
         payload = data[9:9 + payload_len]
         crc_received = int.from_bytes(data[9 + payload_len:], byteorder="big")
-        crc_calculated = zlib.crc32(data[:9 + payload_len]) & 0xFFFFFFFF
+        if crc:
+            crc_calculated = zlib.crc32(data[:9 + payload_len]) & 0xFFFFFFFF
 
-        if crc_calculated != crc_received:
-            raise ValueError("CRC mismatch")
+            if crc_calculated != crc_received:
+                raise ValueError("CRC mismatch")
 
-        return SelectiveRepeatSegment(payload, seq_num,
-                                      ack_num, win_size, eof_num)
+        return SelectiveRepeatSegment(payload, seq_num, ack_num, win_size,
+                                      eof_num, sack, parity)
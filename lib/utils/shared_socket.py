@@ -0,0 +1,34 @@
+import threading
+
+from lib.utils import batch_io
+
+
+class SharedSocket:
+    """Thread-safe send path over the listening socket, shared by every
+    server session so fd usage does not grow with the number of clients.
+    Only the server closes the underlying socket"""
+
+    def __init__(self, socket_):
+        self.socket = socket_
+        self.lock = threading.Lock()
+
+    def sendto(self, data, address):
+        with self.lock:
+            return self.socket.sendto(data, address)
+
+    def sendmany(self, packets, address):
+        with self.lock:
+            batch_io.sendmany(self.socket, packets, address)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def getsockname(self):
+        return self.socket.getsockname()
+
+    def settimeout(self, timeout):
+        # El timeout es del socket de escucha, no de cada sesión
+        pass
+
+    def close(self):
+        pass
@@ -1,16 +1,77 @@
+import argparse
+
 from lib.protocols.stop_and_wait import StopAndWait
 from lib.protocols.selective_repeat import SelectiveRepeat
-from lib.utils.constants import SELECTIVE_REPEAT, STOP_AND_WAIT
+from lib.protocols.async_stop_and_wait import AsyncStopAndWait
+from lib.protocols.async_selective_repeat import AsyncSelectiveRepeat
+from lib.protocols.forward_error_correction import ForwardErrorCorrection
+from lib.protocols.async_forward_error_correction import (
+    AsyncForwardErrorCorrection)
+from lib.utils.constants import (
+    ACK_DELAY, ACK_EVERY, CHECKSUM_CRC32, CHECKSUM_NONE, COMPRESSION_NONE,
+    COMPRESSION_ZLIB, CONGESTION, FEC_BLOCK, FEC_PARITY,
+    FORWARD_ERROR_CORRECTION, MAX_ACK_DELAY, MAX_SEGMENT_SIZE,
+    MIN_SEGMENT_SIZE, RATE,
+    SELECTIVE_REPEAT, STOP_AND_WAIT, WINDOW_SIZE)
+
+RATE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+COMPRESSIONS = {
+    'none': COMPRESSION_NONE,
+    'zlib': COMPRESSION_ZLIB,
+}
+
+CHECKSUMS = {
+    'crc32': CHECKSUM_CRC32,
+    'none': CHECKSUM_NONE,
+}
+
+PROTOCOL_NAMES = {
+    STOP_AND_WAIT: 'sw',
+    SELECTIVE_REPEAT: 'sr',
+    FORWARD_ERROR_CORRECTION: 'fec',
+}
 
 
 def get_protocol_name_from_protocol_code(protocol_code):
-    if protocol_code == STOP_AND_WAIT:
-        return 'sw'
-    return 'sr'
+    return PROTOCOL_NAMES.get(protocol_code, 'sr')
 
 
 def get_protocol_code_from_protocol_str(protocol_str):
-    return STOP_AND_WAIT if protocol_str == 'sw' else SELECTIVE_REPEAT
+    for code, name in PROTOCOL_NAMES.items():
+        if name == protocol_str:
+            return code
+    return SELECTIVE_REPEAT
+
+
+def parse_rate(text):
+    """--rate value: auto, or bytes per second with an optional K, M or
+    G suffix"""
+    text = text.strip().upper()
+    if text == "AUTO":
+        return "auto"
+    if text and text[-1] in RATE_UNITS:
+        return float(text[:-1]) * RATE_UNITS[text[-1]]
+    return float(text)
+
+
+def parse_segment_size(text):
+    """--segment-size value: datagram bytes, header included"""
+    size = int(text)
+    if not MIN_SEGMENT_SIZE <= size <= MAX_SEGMENT_SIZE:
+        raise argparse.ArgumentTypeError(
+            f"must be between {MIN_SEGMENT_SIZE} and {MAX_SEGMENT_SIZE}")
+    return size
+
+
+def parse_ack_delay(text):
+    """--ack-delay value: seconds, at most the MAX_ACK_DELAY that every
+    sender adds to its RTO"""
+    delay = float(text)
+    if not 0 <= delay <= MAX_ACK_DELAY:
+        raise argparse.ArgumentTypeError(
+            f"must be between 0 and {MAX_ACK_DELAY}")
+    return delay
 
 
 def get_protocol_from_args(args, socket, destination_address):
@@ -21,12 +82,51 @@ def get_protocol_from_args(args, socket, destination_address):
             socket,
             destination_address,
             args.verbose,
-            args.quiet
+            args.quiet,
+            getattr(args, "rate", RATE)
         )
-    else:
-        return SelectiveRepeat(
+
+    options = (
+        getattr(args, "max_inflight", WINDOW_SIZE),
+        getattr(args, "congestion", CONGESTION),
+        getattr(args, "ack_every", ACK_EVERY),
+        getattr(args, "ack_delay", ACK_DELAY),
+        getattr(args, "rate", RATE)
+    )
+    if protocol == FORWARD_ERROR_CORRECTION:
+        return ForwardErrorCorrection(
             socket,
             destination_address,
             args.verbose,
-            args.quiet
+            args.quiet,
+            *options,
+            getattr(args, "fec_block", FEC_BLOCK),
+            getattr(args, "fec_parity", FEC_PARITY)
         )
+    return SelectiveRepeat(
+        socket,
+        destination_address,
+        args.verbose,
+        args.quiet,
+        *options
+    )
+
+
+def get_async_protocol_from_code(protocol_code, transport,
+                                 destination_address, verbose, quiet,
+                                 window_size=WINDOW_SIZE,
+                                 congestion=CONGESTION,
+                                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY,
+                                 rate=RATE, block=FEC_BLOCK,
+                                 parity=FEC_PARITY):
+    """Protocol handler for the asyncio engine, sends through transport"""
+    if protocol_code == STOP_AND_WAIT:
+        return AsyncStopAndWait(transport, destination_address,
+                                verbose, quiet, rate)
+    if protocol_code == FORWARD_ERROR_CORRECTION:
+        return AsyncForwardErrorCorrection(
+            transport, destination_address, verbose, quiet, window_size,
+            congestion, ack_every, ack_delay, rate, block, parity)
+    return AsyncSelectiveRepeat(transport, destination_address,
+                                verbose, quiet, window_size, congestion,
+                                ack_every, ack_delay, rate)
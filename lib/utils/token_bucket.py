@@ -0,0 +1,45 @@
+import threading
+import time
+
+from lib.utils.constants import PACING_BURST
+
+
+class TokenBucket:
+    """Paces the sends of a session to rate bytes per second. Up to burst
+    bytes go out back to back, past that every send waits for its tokens.
+    A rate of 0 turns pacing off"""
+
+    def __init__(self, rate=0, burst=PACING_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # La comparten el emisor y el watcher de retransmisiones
+        self.lock = threading.Lock()
+
+    def delay(self, nbytes) -> float:
+        """Take the tokens for nbytes, returns how long to wait before
+        sending them. The tokens can go below zero: whoever sends next
+        waits for them too"""
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens
+                              + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def pace(self, nbytes):
+        """Block until nbytes can be sent"""
+        wait = self.delay(nbytes)
+        if wait > 0:
+            time.sleep(wait)
+
+    def charge(self, nbytes):
+        """nbytes go out right away (retransmissions) but take their
+        tokens, the sends behind them wait"""
+        self.delay(nbytes)
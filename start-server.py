@@ -1,5 +1,11 @@
 import argparse
-from lib.server import server_manager
+from lib.server import async_server_manager, server_manager
+from lib.utils.constants import (
+    ACK_DELAY, ACK_EVERY, BUFFER_SIZE, CONGESTION, FEC_BLOCK, FEC_PARITY,
+    IDLE_TIMEOUT, INITIAL_WINDOW, MAX_QUEUE, MAX_SESSIONS, MAX_TRANSFERS,
+    METRICS_INTERVAL, RATE, WINDOW_SIZE)
+from lib.utils.static import (
+    parse_ack_delay, parse_rate, parse_segment_size)
 
 
 def add_arguments(parser):
@@ -25,23 +31,114 @@ def add_arguments(parser):
         metavar="", help="storage dir path",
     )
     parser.add_argument(
-        "-r", "--protocol", type=str, choices=["sw", "sr"],
+        "-r", "--protocol", type=str, choices=["sw", "sr", "fec"],
         default="sw", metavar="", help="error recovery protocol",
     )
+    parser.add_argument(
+        "-e", "--engine", type=str, choices=["thread", "asyncio"],
+        default="thread", metavar="", help="server engine",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        metavar="", help="worker processes sharing ADDR:PORT",
+    )
+    parser.add_argument(
+        "--shared-socket", action="store_true",
+        help="send every session through the listening socket",
+    )
+    parser.add_argument(
+        "--idle-timeout", type=float, default=IDLE_TIMEOUT,
+        metavar="", help="seconds before evicting an idle session",
+    )
+    parser.add_argument(
+        "--max-sessions", type=int, default=MAX_SESSIONS,
+        metavar="", help="maximum concurrent sessions",
+    )
+    parser.add_argument(
+        "--max-transfers", type=int, default=MAX_TRANSFERS,
+        metavar="", help="maximum transfers in progress",
+    )
+    parser.add_argument(
+        "--max-inflight", type=int, default=WINDOW_SIZE,
+        metavar="", help="maximum packets in flight per session (sr)",
+    )
+    parser.add_argument(
+        "--congestion", type=str, choices=["reno", "delay"],
+        default=CONGESTION, metavar="", help="congestion control (sr)",
+    )
+    parser.add_argument(
+        "--ack-every", type=int, default=ACK_EVERY,
+        metavar="", help="segments confirmed by each ACK (sr)",
+    )
+    parser.add_argument(
+        "--ack-delay", type=parse_ack_delay, default=ACK_DELAY,
+        metavar="", help="seconds an ACK waits for more segments (sr)",
+    )
+    parser.add_argument(
+        "--rate", type=parse_rate, default=RATE, metavar="",
+        help="pacing in bytes/s (K, M, G suffixes) or auto",
+    )
+    parser.add_argument(
+        "--fec-block", type=int, default=FEC_BLOCK,
+        metavar="", help="data segments per parity block (fec)",
+    )
+    parser.add_argument(
+        "--fec-parity", type=int, default=FEC_PARITY,
+        metavar="", help="parity segments per block (fec)",
+    )
+    parser.add_argument(
+        "--segment-size", type=parse_segment_size, default=BUFFER_SIZE,
+        metavar="", help="largest segment size a session can use",
+    )
+    parser.add_argument(
+        "--initial-window", type=int, default=INITIAL_WINDOW, metavar="",
+        help="initial congestion window in segments, if the client does"
+        " not ask (sr)",
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=MAX_QUEUE,
+        metavar="", help="maximum datagrams queued for all sessions",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=0,
+        metavar="", help="serve metrics on http://127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "--metrics-file", type=str, default=None,
+        metavar="", help="dump metrics as JSON to this file",
+    )
+    parser.add_argument(
+        "--metrics-interval", type=float, default=METRICS_INTERVAL,
+        metavar="", help="seconds between metrics file dumps",
+    )
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog='start-server',
         usage='start-server [-h] [-v | -q] [-H ADDR] [-p PORT] [-s DIRPATH]'
-        ' [-r protocol]',
+        ' [-r protocol] [-e engine] [-w N]'
+        ' [--shared-socket] [--idle-timeout SECONDS] [--max-sessions N]'
+        ' [--max-transfers N] [--max-inflight N] [--congestion algorithm]'
+        ' [--ack-every N] [--ack-delay SECONDS] [--rate RATE]'
+        ' [--fec-block N] [--fec-parity N] [--segment-size N]'
+        ' [--initial-window N]'
+        ' [--max-queue N] [--metrics-port PORT] [--metrics-file PATH]'
+        ' [--metrics-interval SECONDS]',
         description='Start the UDP file transfer server, will listen'
         ' on ADDR:PORT',
         formatter_class=argparse.RawTextHelpFormatter
     )
     add_arguments(parser)
     args = parser.parse_args()
-    server_manager.run(args)
+    engine = server_manager
+    if args.engine == "asyncio":
+        engine = async_server_manager
+
+    if args.workers > 1:
+        server_manager.run_workers(args, engine.run)
+    else:
+        engine.run(args)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 import argparse
 from lib.client.client_manager import run
 from lib.client.uploader import Uploader
+from lib.utils.constants import (
+    BUFFER_SIZE, CONGESTION, FEC_BLOCK, FEC_PARITY, RATE)
+from lib.utils.static import (
+    CHECKSUMS, COMPRESSIONS, parse_rate, parse_segment_size)
 
 
 def add_arguments(parser):
@@ -30,17 +34,60 @@ def add_arguments(parser):
         metavar="", help="source file path"
     )
     parser.add_argument(
-        "-r", "--protocol", type=str, choices=["sw", "sr"],
+        "-r", "--protocol", type=str, choices=["sw", "sr", "fec"],
         default="sw", required=False,
         metavar="", help="error recovery protocol",
     )
+    parser.add_argument(
+        "--congestion", type=str, choices=["reno", "delay"],
+        default=CONGESTION, metavar="", help="congestion control (sr)",
+    )
+    parser.add_argument(
+        "--rate", type=parse_rate, default=RATE, metavar="",
+        help="pacing in bytes/s (K, M, G suffixes) or auto",
+    )
+    parser.add_argument(
+        "--fec-block", type=int, default=FEC_BLOCK,
+        metavar="", help="data segments per parity block (fec)",
+    )
+    parser.add_argument(
+        "--fec-parity", type=int, default=FEC_PARITY,
+        metavar="", help="parity segments per block (fec)",
+    )
+    parser.add_argument(
+        "--segment-size", type=parse_segment_size, default=BUFFER_SIZE,
+        metavar="", help="segment size in bytes, header included",
+    )
+    parser.add_argument(
+        "--pmtu", action="store_true",
+        help="probe the largest segment size the path carries whole",
+    )
+    parser.add_argument(
+        "--initial-window", type=int, default=None,
+        metavar="", help="initial congestion window in segments (sr)",
+    )
+    parser.add_argument(
+        "--compress", type=str, choices=list(COMPRESSIONS),
+        default="none", metavar="", help="segment compression (none, zlib)",
+    )
+    parser.add_argument(
+        "--checksum", type=str, choices=list(CHECKSUMS),
+        default="crc32", metavar="", help="segment checksum (crc32, none)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue a partial transfer of the same file",
+    )
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog="upload",
         usage="upload [-h] [-v | -q] [-H ADDR] [-p PORT] [-s FILEPATH]"
-        " [-n FILENAME] [-r protocol]",
+        " [-n FILENAME] [-r protocol] [--congestion algorithm]"
+        " [--rate RATE] [--fec-block N] [--fec-parity N]"
+        " [--segment-size N] [--pmtu] [--initial-window N]"
+        " [--compress algorithm] [--checksum algorithm] [--resume]",
         description="Upload the file located in FILEPATH to the server running"
         " on ADDR:PORT, will be saved as FILENAME",
         formatter_class=argparse.RawTextHelpFormatter,
@@ -56,6 +103,16 @@ def main():
         print(f"Port         : {args.port}")
         print(f"Name         : {args.name}")
         print(f"Protocol     : {args.protocol}")
+        print(f"Congestion   : {args.congestion}")
+        print(f"Rate         : {args.rate}")
+        print(f"FEC block    : {args.fec_block}")
+        print(f"FEC parity   : {args.fec_parity}")
+        print(f"Segment size : {args.segment_size}")
+        print(f"PMTU probing : {args.pmtu}")
+        print(f"Init window  : {args.initial_window}")
+        print(f"Compression  : {args.compress}")
+        print(f"Checksum     : {args.checksum}")
+        print(f"Resume       : {args.resume}")
 
     return run(Uploader(args))
 